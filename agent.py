@@ -10,6 +10,8 @@ import re
 from typing import Dict, Any, Optional
 from datetime import datetime
 
+from http_pool import http_pool
+
 # Config
 GEMINI_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
@@ -44,7 +46,7 @@ class GeminiClient:
         chat = self.model.start_chat(history=conversation[:-1] if len(conversation) > 1 else [])
         last = conversation[-1]["parts"][0] if conversation else ""
         
-        resp = chat.send_message(
+        resp = await chat.send_message_async(
             last,
             generation_config={"temperature": temperature, "max_output_tokens": 800}
         )
@@ -55,23 +57,19 @@ class TwentyAPI:
     """API Twenty simplificada."""
     
     async def request(self, method: str, endpoint: str, data: dict = None) -> dict:
-        import httpx
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {TWENTY_KEY}"}
-            if method != "GET":
-                headers["Content-Type"] = "application/json"
-            
-            url = f"{TWENTY_URL}{endpoint}"
-            if method == "GET":
-                resp = await client.get(url, headers=headers, timeout=30)
-            elif method == "POST":
-                # Alguns endpoints usam {data: ...}, outros não
-                resp = await client.post(url, headers=headers, json=data, timeout=30)
-            else:
-                resp = await client.request(method, url, headers=headers, json=data, timeout=30)
-            
-            resp.raise_for_status()
-            return resp.json() if resp.status_code != 204 else {}
+        headers = {"Authorization": f"Bearer {TWENTY_KEY}"}
+        if method != "GET":
+            headers["Content-Type"] = "application/json"
+        
+        url = f"{TWENTY_URL}{endpoint}"
+        if method == "GET":
+            resp = await http_pool.request("GET", url, headers=headers)
+        else:
+            # Alguns endpoints usam {data: ...}, outros não
+            resp = await http_pool.request(method, url, headers=headers, json=data)
+        
+        resp.raise_for_status()
+        return resp.json() if resp.status_code != 204 else {}
     
     async def list_people(self) -> list:
         r = await self.request("GET", "/people?limit=60")
@@ -163,6 +161,14 @@ class Memory:
 class MondayAgent:
     """Agente Monday - núcleo do sistema."""
     
+    # Campos obrigatórios por intent: cada grupo precisa de pelo menos um preenchido
+    REQUIRED_FIELDS = {
+        "create_person": [["nome", "name"], ["email", "telefone", "phone"]],
+        "create_task": [["titulo", "title"]],
+        "search_people": [["nome", "name"]],
+        "search_by_field": [["campo", "field"]],
+    }
+    
     def __init__(self):
         self.gemini = GeminiClient()
         self.twenty = TwentyAPI()
@@ -268,15 +274,8 @@ Responda APENAS com o JSON."""
             # Junta dados
             all_data = {**ctx["data"], **novos}
             
-            # Verifica se agora tem tudo
-            prompt_check = f"""Ação: {ctx['intent']}
-Dados: {json.dumps(all_data)}
-
-Tem todos os dados necessários? Responda apenas SIM ou NÃO."""
-            
-            check = await self.gemini.complete([{"role": "user", "content": prompt_check}], temperature=0.1)
-            
-            if "SIM" in check.upper():
+            # Verifica se agora tem tudo (localmente, sem outra chamada ao LLM)
+            if self._has_required(ctx["intent"], all_data):
                 # Executa!
                 result = await self._execute(ctx["intent"], all_data)
                 self.memory.clear_context(user_id, channel)
@@ -289,6 +288,10 @@ Tem todos os dados necessários? Responda apenas SIM ou NÃO."""
         except Exception as e:
             return f"Erro: {str(e)[:100]}. Vamos tentar de novo?"
     
+    def _has_required(self, intent: str, data: dict) -> bool:
+        groups = self.REQUIRED_FIELDS.get(intent, [])
+        return all(any(data.get(field) for field in group) for group in groups)
+    
     async def _execute(self, intent: str, params: dict) -> str:
         """Executa ação no CRM."""
         try:
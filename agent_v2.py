@@ -5,17 +5,331 @@ LLM decide qual ferramenta usar baseado na pergunta
 import os
 import json
 import re
+import time
+import asyncio
+import weakref
+import unicodedata
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional
-from datetime import datetime
+from urllib.parse import quote
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from http_pool import http_pool
+from state_backend import get_state_backend
+from metrics import (
+    HANDLE_LATENCY, LLM_LATENCY, TWENTY_LATENCY,
+    TOOL_CALLS, ERRORS, IN_FLIGHT, endpoint_label, cache_lookup,
+)
+from tracing import span, traced, current_span
+
 GEMINI_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
 TWENTY_URL = os.getenv("TWENTY_API_URL", "")
 TWENTY_KEY = os.getenv("TWENTY_API_KEY", os.getenv("TWENTY_KEY", ""))
 
+# Quantas chamadas ao Gemini podem estar em voo ao mesmo tempo (por event loop)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# Cache de decisões do LLM (mensagem normalizada -> tool + params)
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+# TTL (segundos) do espelho local de cada coleção do CRM
+CACHE_TTL = {
+    "people": float(os.getenv("CACHE_TTL_PEOPLE", "120")),
+    "companies": float(os.getenv("CACHE_TTL_COMPANIES", "300")),
+    "opportunities": float(os.getenv("CACHE_TTL_OPPORTUNITIES", "60")),
+    "tasks": float(os.getenv("CACHE_TTL_TASKS", "60")),
+}
+CACHE_MAX_RECORDS = int(os.getenv("CACHE_MAX_RECORDS", "5000"))
+
+# Tamanho de página usado na paginação por cursor do Twenty
+TWENTY_PAGE_SIZE = int(os.getenv("TWENTY_PAGE_SIZE", "60"))
+
+# Etapas do pipeline de oportunidades no Twenty
+PIPELINE_STAGES = [
+    "PROSPECCAO", "CONTATO_INICIADO", "CONVERSA_ESTABELECIDA", "QUALIFICADO",
+    "NEGOCIACAO", "FECHADO_GANHO", "FECHADO_PERDIDO",
+]
+
+# Score mínimo do NameIndex para considerar que um nome "é" aquele registro
+NAME_MATCH_SCORE = 0.8
+
+# Nomes de etapa aceitos na criação de oportunidades -> código
+STAGE_MAP = {
+    "prospeccao": "PROSPECCAO", "prospeção": "PROSPECCAO",
+    "contato iniciado": "CONTATO_INICIADO", "conversa estabelecida": "CONVERSA_ESTABELECIDA",
+    "qualificado": "QUALIFICADO", "qualificada": "QUALIFICADO",
+    "negociacao": "NEGOCIACAO", "negociação": "NEGOCIACAO",
+    "fechado ganho": "FECHADO_GANHO", "ganho": "FECHADO_GANHO",
+    "fechado perdido": "FECHADO_PERDIDO", "perdido": "FECHADO_PERDIDO",
+}
+
+# Quantos resultados as buscas mostram (o resto da coleção nem é baixado)
+SEARCH_MAX_RESULTS = 10
+
+
+# =============================================================================
+# CACHE - Espelho local do CRM
+# =============================================================================
+
+# Letras que ganham acento em português (ilike do Twenty não ignora acento)
+ACCENTED = re.compile(r"[aeiouc]")
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos, só letras/números separados por um espaço."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def name_matches(query: str, name: str) -> bool:
+    """Cada palavra da busca aparece no nome, sem acento (a regra do `_name_filter`)."""
+    norm = normalize_text(name)
+    return all(word in norm for word in normalize_text(query).split())
+
+
+def record_name(record: dict) -> str:
+    """Nome de exibição de uma pessoa ou empresa (string ou {firstName, lastName})."""
+    name = record.get("name", "")
+    if isinstance(name, dict):
+        name = f"{name.get('firstName', '')} {name.get('lastName', '')}".strip()
+    return str(name or "")
+
+
+class NameIndex:
+    """Índice de nomes por prefixo de palavra e trigramas, sem acentos.
+    
+    Responde "qual registro tem esse nome?" sem varrer a coleção: os prefixos
+    e trigramas do termo buscado apontam os candidatos, que são ranqueados:
+    igual (1.0) > começa com (0.9) > contém / está contido (0.8) > parecido
+    (similaridade de trigramas).
+    """
+    
+    MAX_PREFIX = 12
+    MIN_SCORE = 0.35
+    
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+        self._display: Dict[str, str] = {}
+        self._gram_counts: Dict[str, int] = {}
+        self._prefixes: Dict[str, set] = {}
+        self._trigrams: Dict[str, set] = {}
+    
+    def __len__(self):
+        return len(self._names)
+    
+    @staticmethod
+    def _grams(norm: str) -> set:
+        padded = f"  {norm} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def add(self, record_id: str, name: str):
+        if not record_id:
+            return
+        self.remove(record_id)
+        norm = normalize_text(name)
+        if not norm:
+            return
+        self._names[record_id] = norm
+        self._display[record_id] = name
+        for token in norm.split():
+            for i in range(1, min(len(token), self.MAX_PREFIX) + 1):
+                self._prefixes.setdefault(token[:i], set()).add(record_id)
+        grams = self._grams(norm)
+        self._gram_counts[record_id] = len(grams)
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(record_id)
+    
+    def remove(self, record_id: str):
+        norm = self._names.pop(record_id, None)
+        self._display.pop(record_id, None)
+        self._gram_counts.pop(record_id, None)
+        if norm is None:
+            return
+        for token in norm.split():
+            for i in range(1, min(len(token), self.MAX_PREFIX) + 1):
+                self._prefixes.get(token[:i], set()).discard(record_id)
+        for gram in self._grams(norm):
+            self._trigrams.get(gram, set()).discard(record_id)
+    
+    def lookup(self, query: str, limit: int = 5) -> List[dict]:
+        """Candidatos ranqueados: [{"id", "name", "score"}, ...]."""
+        q = normalize_text(query)
+        if not q:
+            return []
+        
+        tokens = q.split()
+        candidates = set()
+        for token in tokens:
+            candidates |= self._prefixes.get(token[:self.MAX_PREFIX], set())
+        q_grams = self._grams(q)
+        shared: Dict[str, int] = {}
+        for gram in q_grams:
+            for record_id in self._trigrams.get(gram, ()):
+                shared[record_id] = shared.get(record_id, 0) + 1
+        # Só vale a pena ranquear quem divide uma boa parte dos trigramas
+        min_shared = max(2, int(len(q_grams) * 0.4))
+        candidates |= {record_id for record_id, n in shared.items() if n >= min_shared}
+        
+        return self._rank(q, candidates, shared, len(q_grams), limit)
+    
+    def containing(self, query: str, limit: int = 5) -> List[dict]:
+        """Só os nomes com todas as palavras da busca, ranqueados como em `lookup`.
+        
+        É a mesma regra de `name_matches` e do filtro ilike do Twenty, então
+        com ou sem espelho a busca acha as mesmas pessoas.
+        """
+        q = normalize_text(query)
+        if not q:
+            return []
+        tokens = q.split()
+        candidates = {
+            record_id for record_id, norm in self._names.items()
+            if all(t in norm for t in tokens)
+        }
+        q_grams = self._grams(q)
+        shared = {
+            record_id: len(q_grams & self._grams(self._names[record_id]))
+            for record_id in candidates
+        }
+        return self._rank(q, candidates, shared, len(q_grams), limit, min_score=0.0)
+    
+    def _rank(self, q: str, candidates: set, shared: Dict[str, int], n_query_grams: int,
+              limit: int, min_score: float = None) -> List[dict]:
+        min_score = self.MIN_SCORE if min_score is None else min_score
+        tokens = q.split()
+        ranked = []
+        for record_id in candidates:
+            norm = self._names[record_id]
+            if norm == q:
+                score = 1.0
+            elif norm.startswith(q) or all(
+                any(w.startswith(t) for w in norm.split()) for t in tokens
+            ):
+                score = 0.9
+            elif q in norm or norm in q:
+                score = 0.8
+            else:
+                n_grams = self._gram_counts[record_id]
+                score = 0.7 * 2 * shared.get(record_id, 0) / (n_query_grams + n_grams)
+            if score >= min_score:
+                ranked.append({"id": record_id, "name": self._display[record_id], "score": round(score, 3)})
+        
+        ranked.sort(key=lambda c: (-c["score"], c["name"]))
+        return ranked[:limit]
+
+
+class CRMMirror:
+    """Espelho em memória de people/companies/opportunities/tasks.
+    
+    Cada coleção é guardada inteira (por id) com TTL próprio. Coleções maiores
+    que max_records não são espelhadas, assim a memória fica limitada e uma
+    busca local nunca responde com um espelho pela metade. People e companies
+    ganham também um NameIndex, mantido junto com o espelho.
+    """
+    
+    INDEXED = ("people", "companies")
+    
+    def __init__(self, ttl: Dict[str, float] = None, max_records: int = CACHE_MAX_RECORDS):
+        self.ttl = ttl or dict(CACHE_TTL)
+        self.max_records = max_records
+        self._records: Dict[str, OrderedDict] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._indexes: Dict[str, NameIndex] = {}
+        self._too_large: Dict[str, float] = {}
+        self._writes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def _fresh(self, collection: str, stamps: Dict[str, float] = None) -> bool:
+        stamp = (self._loaded_at if stamps is None else stamps).get(collection)
+        return stamp is not None and time.monotonic() - stamp <= self.ttl.get(collection, 60)
+    
+    def get(self, collection: str) -> Optional[list]:
+        """Retorna os registros da coleção se o espelho estiver válido."""
+        if not self._fresh(collection):
+            self.invalidate(collection)
+            self.misses += 1
+            cache_lookup("mirror", False)
+            return None
+        self.hits += 1
+        cache_lookup("mirror", True)
+        return list(self._records[collection].values())
+    
+    def put(self, collection: str, records: list) -> bool:
+        """Substitui o espelho da coleção. Retorna False se ela for grande demais."""
+        if len(records) > self.max_records:
+            self.mark_too_large(collection)
+            return False
+        self._too_large.pop(collection, None)
+        self._records[collection] = OrderedDict(
+            (r.get("id") or str(i), r) for i, r in enumerate(records)
+        )
+        self._loaded_at[collection] = time.monotonic()
+        if collection in self.INDEXED:
+            index = NameIndex()
+            for record_id, record in self._records[collection].items():
+                index.add(record_id, record_name(record))
+            self._indexes[collection] = index
+        return True
+    
+    def upsert(self, collection: str, record: dict):
+        """Write-through: aplica um registro recém-criado/alterado no espelho."""
+        self._writes[collection] = self._writes.get(collection, 0) + 1
+        records = self._records.get(collection)
+        if records is None:
+            return
+        if not record or not record.get("id"):
+            # Sem o registro em mãos não dá pra manter o espelho coerente
+            self.invalidate(collection)
+            return
+        records[record["id"]] = record
+        if collection in self._indexes:
+            self._indexes[collection].add(record["id"], record_name(record))
+        if len(records) > self.max_records:
+            self.mark_too_large(collection)
+    
+    def mark_too_large(self, collection: str):
+        """Coleção passou de max_records: não tenta espelhar de novo até o TTL."""
+        self.invalidate(collection)
+        self._too_large[collection] = time.monotonic()
+    
+    def too_large(self, collection: str) -> bool:
+        return self._fresh(collection, self._too_large)
+    
+    def writes(self, collection: str) -> int:
+        """Quantas escritas a coleção já recebeu (quem lê devagar confere antes de `put`)."""
+        return self._writes.get(collection, 0)
+    
+    def invalidate(self, collection: str = None):
+        collections = [collection] if collection else list(self._records)
+        for c in collections:
+            self._records.pop(c, None)
+            self._loaded_at.pop(c, None)
+            self._indexes.pop(c, None)
+    
+    def record(self, collection: str, record_id: str) -> Optional[dict]:
+        return self._records.get(collection, {}).get(record_id)
+    
+    def index(self, collection: str) -> Optional[NameIndex]:
+        """Índice de nomes da coleção, se o espelho estiver válido (sem copiar nem contar)."""
+        if not self._fresh(collection):
+            return None
+        return self._indexes.get(collection)
+    
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "collections": {c: len(r) for c, r in self._records.items()},
+            "too_large": [c for c in self._too_large if self.too_large(c)],
+        }
+
 
 # =============================================================================
 # TOOLS - Ferramentas disponíveis para o LLM
@@ -26,46 +340,242 @@ class Tools:
     
     def __init__(self):
         self.client = None  # Inicializado depois
+        self.cache = CRMMirror()
+        self.warm_mirror = True  # Desligado na gravação/replay (ver replay.py)
+        self._warming = weakref.WeakKeyDictionary()  # loop -> {coleção: tarefa}
     
     async def _api_request(self, method: str, endpoint: str, data: dict = None) -> dict:
+        headers = {"Authorization": f"Bearer {TWENTY_KEY}"}
+        if method != "GET":
+            headers["Content-Type"] = "application/json"
+        
+        url = f"{TWENTY_URL.rstrip('/')}{endpoint}"
+        label = endpoint_label(endpoint)
+        try:
+            with span("twenty", method=method, endpoint=label) as s, \
+                    TWENTY_LATENCY.labels(method=method, endpoint=label).time():
+                headers["traceparent"] = s.traceparent
+                if method == "GET":
+                    resp = await http_pool.request("GET", url, headers=headers)
+                else:
+                    resp = await http_pool.request(method, url, headers=headers, json=data)
+                s.set(status_code=resp.status_code)
+                resp.raise_for_status()
+        except Exception:
+            ERRORS.labels(stage="twenty").inc()
+            raise
+        return resp.json() if resp.status_code != 204 else {}
+    
+    async def _iter_records(self, collection: str, filter: str = None, predicate=None, fresh: bool = False):
+        """Percorre uma coleção inteira, página por página (cursor do pageInfo).
+        
+        Com o espelho local válido, filtra em memória com `predicate` (zero
+        requisições). Senão manda `filter` para o Twenty e só trafegam os
+        registros que batem; `predicate` vale também para eles (o filtro pode
+        ser mais largo, ex: sem acento). Se o Twenty recusar o filtro, cai para a leitura
+        completa filtrada localmente. A leitura completa de uma coleção repõe
+        o espelho. Quem consome pode parar a qualquer momento e as páginas
+        seguintes não são buscadas; nesse caso (e na leitura filtrada) o
+        espelho frio é aquecido em segundo plano. `fresh` ignora o espelho.
+        """
         import httpx
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {TWENTY_KEY}"}
-            if method != "GET":
-                headers["Content-Type"] = "application/json"
-            
-            url = f"{TWENTY_URL.rstrip('/')}{endpoint}"
-            if method == "GET":
-                resp = await client.get(url, headers=headers, timeout=30)
-            elif method == "POST":
-                resp = await client.post(url, headers=headers, json=data, timeout=30)
-            else:
-                resp = await client.request(method, url, headers=headers, json=data, timeout=30)
+        
+        records = None if fresh else self.cache.get(collection)
+        if records is not None:
+            for record in records:
+                if predicate is None or predicate(record):
+                    yield record
+            return
+        
+        if filter:
+            if not fresh:
+                self._warm(collection)
+            yielded = False
+            try:
+                async for page in self._iter_pages(collection, filter):
+                    for record in page:
+                        yielded = True
+                        if predicate is None or predicate(record):
+                            yield record
+                return
+            except httpx.HTTPStatusError as e:
+                if yielded or e.response.status_code != 400:
+                    raise
+                print(f"[Warning] Twenty recusou o filtro '{filter}', filtrando localmente")
+        
+        writes = self.cache.writes(collection)
+        mirror = []
+        try:
+            async for page in self._iter_pages(collection):
+                for record in page:
+                    if mirror is not None:
+                        mirror.append(record)
+                        if len(mirror) > self.cache.max_records:
+                            mirror = None  # Grande demais para espelhar
+                            self.cache.mark_too_large(collection)
+                    if predicate is None or predicate(record):
+                        yield record
+        except GeneratorExit:
+            if mirror is not None and not fresh:
+                self._warm(collection)  # Quem leu parou antes do fim
+            raise
+        
+        if mirror is not None and self.cache.writes(collection) == writes:
+            self.cache.put(collection, mirror)
+    
+    def _warm(self, collection: str):
+        """Agenda a leitura completa da coleção para repor o espelho (uma por vez)."""
+        if not self.warm_mirror or self.cache.too_large(collection):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        tasks = self._warming.setdefault(loop, {})
+        task = tasks.get(collection)
+        if task is None or task.done():
+            tasks[collection] = loop.create_task(self._fill_mirror(collection))
+    
+    async def _fill_mirror(self, collection: str):
+        """Baixa a coleção inteira (até max_records) e põe no espelho.
+        
+        Olha o totalCount antes: coleção grande demais fica marcada sem baixar nada.
+        """
+        writes = self.cache.writes(collection)
+        records = []
+        try:
+            total = await self._remote_count(collection)
+            if total is not None and total > self.cache.max_records:
+                self.cache.mark_too_large(collection)
+                return
+            async for page in self._iter_pages(collection):
+                records.extend(page)
+                if len(records) > self.cache.max_records:
+                    self.cache.mark_too_large(collection)
+                    return
+        except Exception as e:
+            print(f"[Warning] Erro ao aquecer o espelho de {collection}: {type(e).__name__}: {e}")
+            return
+        # Uma escrita no meio da leitura pode ter ficado de fora: o próximo leitor tenta de novo
+        if self.cache.writes(collection) == writes:
+            self.cache.put(collection, records)
+    
+    async def _iter_pages(self, collection: str, filter: str = None):
+        """Páginas de uma coleção do Twenty, seguindo o cursor até o fim."""
+        cursor = None
+        while True:
+            endpoint = f"/{collection}?limit={TWENTY_PAGE_SIZE}"
+            if filter:
+                endpoint += f"&filter={quote(filter)}"
+            if cursor:
+                endpoint += f"&starting_after={quote(cursor)}"
+            r = await self._api_request("GET", endpoint)
+            page = r.get("data", {}).get(collection, r.get("data", []))
+            yield page
             
-            resp.raise_for_status()
-            return resp.json() if resp.status_code != 204 else {}
+            page_info = r.get("pageInfo") or r.get("data", {}).get("pageInfo") or {}
+            cursor = page_info.get("endCursor")
+            if not page or not page_info.get("hasNextPage") or not cursor:
+                break
+    
+    async def _count_records(self, collection: str, filter: str = None, predicate=None) -> int:
+        """Conta registros sem baixá-los: espelho local ou totalCount do Twenty.
+        
+        Com o espelho válido conta em memória. Senão pede uma página de 1
+        registro e usa o totalCount da resposta. Só se o Twenty não mandar
+        totalCount (ou recusar o filtro) é que percorre a coleção contando.
+        """
+        records = self.cache.get(collection)
+        if records is not None:
+            return sum(1 for r in records if predicate is None or predicate(r))
+        
+        if filter or predicate is None:
+            total = await self._remote_count(collection, filter)
+            if total is not None:
+                return total
+        
+        total = 0
+        async for _ in self._iter_records(collection, predicate=predicate):
+            total += 1
+        return total
+    
+    async def _remote_count(self, collection: str, filter: str = None) -> Optional[int]:
+        """totalCount do Twenty (uma página de 1 registro); None se não vier ou o filtro for recusado."""
+        import httpx
+        
+        endpoint = f"/{collection}?limit=1"
+        if filter:
+            endpoint += f"&filter={quote(filter)}"
+        try:
+            r = await self._api_request("GET", endpoint)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 400:
+                raise
+            return None
+        total = r.get("totalCount", r.get("data", {}).get("totalCount"))
+        return total if isinstance(total, int) else None
+    
+    async def aclose(self):
+        """Cancela as leituras de fundo do loop atual (antes de fechar o http_pool)."""
+        tasks = list(self._warming.pop(asyncio.get_running_loop(), {}).values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _take(self, records, limit: int) -> list:
+        """Consome um iterador assíncrono até juntar `limit` registros."""
+        taken = []
+        if limit <= 0:
+            return taken
+        async for record in records:
+            taken.append(record)
+            if len(taken) >= limit:
+                break
+        return taken
+    
+    def _created_record(self, result: dict) -> dict:
+        """Extrai o registro criado da resposta do Twenty ({"data": {"createX": {...}}})."""
+        data = result.get("data", result) if isinstance(result, dict) else {}
+        if not isinstance(data, dict):
+            return {}
+        if "id" in data:
+            return data
+        for value in data.values():
+            if isinstance(value, dict) and "id" in value:
+                return value
+        return {}
     
     # ---------- PESSOAS ----------
     async def list_people(self, limit: int = 50) -> str:
         """Lista todos os contatos/pessoas do CRM"""
-        r = await self._api_request("GET", f"/people?limit={limit}")
-        people = r.get("data", {}).get("people", r.get("data", []))
+        people = await self._take(self._iter_records("people"), limit)
         return self._format_people_list(people)
     
     async def search_people(self, name: str) -> str:
         """Busca pessoas por nome"""
-        r = await self._api_request("GET", "/people?limit=100")
-        all_people = r.get("data", {}).get("people", r.get("data", []))
-        filtered = [p for p in all_people if name.lower() in str(p.get("name", "")).lower()]
+        # Com o índice em memória: sem acento, ranqueado e sem requisição. Acha
+        # as mesmas pessoas que o filtro do Twenty; os nomes só parecidos
+        # (erro de digitação) entram quando nenhum contém a busca
+        index = self.cache.index("people")
+        if index is not None:
+            candidates = index.containing(name, SEARCH_MAX_RESULTS) or index.lookup(name, SEARCH_MAX_RESULTS)
+            filtered = [self.cache.record("people", c["id"]) for c in candidates]
+            if not filtered:
+                return f"Não achei ninguém com '{name}'."
+            return self._format_people_list(filtered)
+        
+        records = self._iter_records(
+            "people",
+            filter=self._name_filter(name),
+            predicate=lambda p: name_matches(name, record_name(p)),
+        )
+        filtered = await self._take(records, SEARCH_MAX_RESULTS)
         if not filtered:
             return f"Não achei ninguém com '{name}'."
         return self._format_people_list(filtered)
     
     async def search_people_by_field(self, field: str) -> str:
         """Busca pessoas que têm um campo específico preenchido (instagram, linkedin, email, phone)"""
-        r = await self._api_request("GET", "/people?limit=100")
-        all_people = r.get("data", {}).get("people", r.get("data", []))
-        
         field_map = {
             "instagram": "instagram", "linkedin": "linkedinLink", "linked": "linkedinLink",
             "twitter": "xLink", "x": "xLink", "email": "emails", "telefone": "phones",
@@ -73,12 +583,22 @@ class Tools:
         }
         api_field = field_map.get(field.lower(), field)
         
-        filtered = []
-        for p in all_people:
+        # Subcampo que indica "preenchido" em cada tipo composto do Twenty
+        subfield_map = {"emails": "primaryEmail", "phones": "primaryPhoneNumber"}
+        subfield = subfield_map.get(api_field, "primaryLinkUrl")
+        
+        def has_field(p: dict) -> bool:
             field_data = p.get(api_field, {})
             if isinstance(field_data, dict):
-                if field_data.get("primaryLinkUrl") or field_data.get("primaryEmail") or field_data.get("primaryPhoneNumber"):
-                    filtered.append(p)
+                return bool(field_data.get("primaryLinkUrl") or field_data.get("primaryEmail") or field_data.get("primaryPhoneNumber"))
+            return False
+        
+        records = self._iter_records(
+            "people",
+            filter=f'{api_field}.{subfield}[neq]:""' if api_field in field_map.values() else None,
+            predicate=has_field,
+        )
+        filtered = await self._take(records, SEARCH_MAX_RESULTS)
         
         if not filtered:
             return f"Não achei ninguém com '{field}' cadastrado."
@@ -103,30 +623,25 @@ class Tools:
             if company_id:
                 data["companyId"] = company_id
         
-        await self._api_request("POST", "/people", data)
+        result = await self._api_request("POST", "/people", data)
+        self.cache.upsert("people", self._created_record(result))
         company_msg = f" (empresa: {company})" if company else ""
         return f"✅ Contato criado: {name}{company_msg}"
     
     async def _get_or_create_company(self, name: str) -> str:
         """Busca empresa pelo nome, cria se não existir. Retorna o ID."""
         try:
-            # Busca empresas
-            r = await self._api_request("GET", "/companies?limit=100")
-            companies = r.get("data", {}).get("companies", r.get("data", []))
-            
-            # Procura por nome similar
-            name_lower = name.lower()
-            for c in companies:
-                c_name = c.get("name", "")
-                if isinstance(c_name, dict):
-                    c_name = f"{c_name.get('firstName', '')} {c_name.get('lastName', '')}".strip()
-                if name_lower in c_name.lower() or c_name.lower() in name_lower:
-                    return c.get("id")
+            # Procura por nome similar (igual, prefixo ou um contido no outro)
+            candidates = await self._find_by_name("companies", name, fresh=True)
+            if candidates and candidates[0]["score"] >= NAME_MATCH_SCORE:
+                return candidates[0]["id"]
             
             # Cria nova empresa
             create_data = {"data": {"name": name}}
             result = await self._api_request("POST", "/companies", create_data)
-            return result.get("data", {}).get("id")
+            company = self._created_record(result)
+            self.cache.upsert("companies", company)
+            return company.get("id")
         except Exception as e:
             print(f"[Warning] Erro ao buscar/criar empresa: {e}")
             return None
@@ -134,37 +649,39 @@ class Tools:
     # ---------- OPORTUNIDADES ----------
     async def list_opportunities(self, stage: str = None, limit: int = 50) -> str:
         """Lista oportunidades. Opcionalmente filtra por etapa/pipeline stage."""
-        r = await self._api_request("GET", f"/opportunities?limit={limit}")
-        opportunities = r.get("data", {}).get("opportunities", r.get("data", []))
-        
+        records = self._iter_records("opportunities")
         if stage:
-            opportunities = self._filter_by_stage(opportunities, stage)
+            targets = self._stage_targets(stage)
+            records = self._iter_records(
+                "opportunities",
+                filter=self._stage_filter(targets),
+                predicate=lambda opp: self._stage_matches(opp, targets),
+            )
         
+        opportunities = await self._take(records, limit)
         return self._format_opportunities_list(opportunities)
     
     async def count_opportunities(self, stage: str = None) -> str:
         """Conta quantas oportunidades existem, opcionalmente filtradas por etapa"""
-        r = await self._api_request("GET", "/opportunities?limit=1000")
-        opportunities = r.get("data", {}).get("opportunities", r.get("data", []))
+        if stage:
+            targets = self._stage_targets(stage)
+            total = await self._count_records(
+                "opportunities",
+                filter=self._stage_filter(targets),
+                predicate=lambda opp: self._stage_matches(opp, targets),
+            )
+        else:
+            total = await self._count_records("opportunities")
         
         if stage:
-            opportunities = self._filter_by_stage(opportunities, stage)
-            return f"📊 {len(opportunities)} oportunidades na etapa '{stage}'"
+            return f"📊 {total} oportunidades na etapa '{stage}'"
         
-        return f"📊 Total de oportunidades: {len(opportunities)}"
+        return f"📊 Total de oportunidades: {total}"
     
     async def create_opportunity(self, name: str, stage: str = "PROSPECCAO", amount: float = None, company: str = None, person: str = None) -> str:
         """Cria uma nova oportunidade."""
         # Mapeia nomes de etapas para códigos
-        stage_map = {
-            "prospeccao": "PROSPECCAO", "prospeção": "PROSPECCAO",
-            "contato iniciado": "CONTATO_INICIADO", "conversa estabelecida": "CONVERSA_ESTABELECIDA",
-            "qualificado": "QUALIFICADO", "qualificada": "QUALIFICADO",
-            "negociacao": "NEGOCIACAO", "negociação": "NEGOCIACAO",
-            "fechado ganho": "FECHADO_GANHO", "ganho": "FECHADO_GANHO",
-            "fechado perdido": "FECHADO_PERDIDO", "perdido": "FECHADO_PERDIDO",
-        }
-        stage_code = stage_map.get(stage.lower(), stage.upper().replace(" ", "_"))
+        stage_code = STAGE_MAP.get(stage.lower(), stage.upper().replace(" ", "_"))
         
         data = {
             "name": name,
@@ -181,33 +698,73 @@ class Tools:
                 data["companyId"] = company_id
         
         # Busca pessoa
+        person_note = ""
         if person:
-            person_id = await self._search_person_id(person)
-            if person_id:
-                data["pointOfContactId"] = person_id
+            candidates = await self._search_person_candidates(person)
+            if candidates and candidates[0]["score"] >= NAME_MATCH_SCORE:
+                data["pointOfContactId"] = candidates[0]["id"]
+                others = [c["name"] for c in candidates[1:] if c["score"] >= NAME_MATCH_SCORE]
+                if others:
+                    person_note = f"\n⚠️ Associei a {candidates[0]['name']}, mas também achei: {', '.join(others)}"
         
-        await self._api_request("POST", "/opportunities", {"data": data})
-        return f"✅ Oportunidade criada: {name} (etapa: {stage_code})"
+        result = await self._api_request("POST", "/opportunities", {"data": data})
+        self.cache.upsert("opportunities", self._created_record(result))
+        return f"✅ Oportunidade criada: {name} (etapa: {stage_code}){person_note}"
     
     async def _search_person_id(self, name: str) -> str:
         """Busca pessoa pelo nome e retorna o ID."""
+        candidates = await self._search_person_candidates(name)
+        if candidates and candidates[0]["score"] >= NAME_MATCH_SCORE:
+            return candidates[0]["id"]
+        return None
+    
+    async def _search_person_candidates(self, name: str) -> List[dict]:
+        """Pessoas com nome parecido, ranqueadas (para desambiguar).
+        
+        Só é usado ao criar/associar registros, então consulta o Twenty e não
+        o espelho (ver _find_by_name).
+        """
         try:
-            r = await self._api_request("GET", "/people?limit=100")
-            people = r.get("data", {}).get("people", r.get("data", []))
-            
-            name_lower = name.lower()
-            for p in people:
-                p_name = p.get("name", "")
-                if isinstance(p_name, dict):
-                    p_name = f"{p_name.get('firstName', '')} {p_name.get('lastName', '')}".strip()
-                if name_lower in p_name.lower():
-                    return p.get("id")
+            return await self._find_by_name("people", name, fresh=True)
         except Exception as e:
             print(f"[Warning] Erro ao buscar pessoa: {e}")
-        return None
+        return []
     
-    def _filter_by_stage(self, opportunities: list, stage_query: str) -> list:
-        """Filtra oportunidades por etapa."""
+    async def _find_by_name(self, collection: str, name: str, limit: int = 5, fresh: bool = False) -> List[dict]:
+        """Candidatos ranqueados pelo NameIndex da coleção.
+        
+        Se o espelho estiver frio, carrega a coleção (uma vez por TTL), mas só
+        depois de ver pelo totalCount que ela cabe no espelho. Grande demais
+        (o estado fica lembrado até o TTL), indexa só o que o filtro ilike
+        trouxer, sem baixar a coleção.
+        
+        `fresh` ignora o espelho e pergunta ao Twenty (filtro ilike). É o que
+        os caminhos de criação usam: o espelho é por worker, e um registro
+        criado em outro worker (ou direto no Twenty) pode ainda não estar nele,
+        o que geraria duplicatas.
+        """
+        index = None if fresh else self.cache.index(collection)
+        if index is None and not fresh and not self.cache.too_large(collection):
+            if await self._count_records(collection) > self.cache.max_records:
+                self.cache.mark_too_large(collection)
+            else:
+                async for _ in self._iter_records(collection):
+                    pass
+                index = self.cache.index(collection)
+        if index is None:
+            index = NameIndex()
+            records = self._iter_records(
+                collection,
+                filter=self._name_filter(name, collection),
+                predicate=lambda r: name_matches(name, record_name(r)),
+                fresh=fresh,
+            )
+            async for record in records:
+                index.add(record.get("id"), record_name(record))
+        return index.lookup(name, limit)
+    
+    def _stage_targets(self, stage_query: str) -> list:
+        """Variações de nome que identificam a etapa pedida."""
         stage_query = stage_query.lower().replace("_", " ").replace("-", " ")
         
         # Mapeamento de nomes comuns para códigos de stage
@@ -220,33 +777,68 @@ class Tools:
         }
         
         # Encontra qual código de stage corresponde à query
-        target_stages = []
         for key, variations in stage_mapping.items():
             if any(v in stage_query for v in variations):
-                target_stages = variations
-                break
+                return variations
         
-        if not target_stages:
-            target_stages = [stage_query]
+        return [stage_query]
+    
+    def _stage_filter(self, target_stages: list) -> Optional[str]:
+        """Filtro do Twenty com os códigos de etapa que batem com as variações."""
+        codes = [c for c in PIPELINE_STAGES if any(t in c.lower() for t in target_stages)]
+        if not codes:
+            return None
+        if len(codes) == 1:
+            return f"stage[eq]:{codes[0]}"
+        return "stage[in]:[" + ",".join(codes) + "]"
+    
+    def _name_filter(self, name: str, collection: str = "people") -> Optional[str]:
+        """Filtro ilike do Twenty: cada palavra no nome (primeiro ou último, em pessoas).
         
-        filtered = []
-        for opp in opportunities:
-            # Stage pode ser string ou objeto
-            opp_stage = opp.get("stage", "")
-            if isinstance(opp_stage, dict):
-                opp_stage = opp_stage.get("name", "")
-            opp_stage = str(opp_stage).lower()
-            
-            if any(t in opp_stage for t in target_stages):
-                filtered.append(opp)
+        Mesma regra de `name_matches`, mas o ilike distingue acento: cada
+        palavra vai com as grafias de `_spellings` ("Joao" também acha "João").
+        O que o filtro trouxer a mais, `name_matches` descarta localmente.
+        """
+        words = [self._spellings(w) for w in re.findall(r"[^\W_]+", name.lower())]
+        if not words:
+            return None
+        fields = ("name.firstName", "name.lastName") if collection == "people" else ("name",)
+        clauses = []
+        for spellings in words:
+            options = [f'{field}[ilike]:"%{s}%"' for s in spellings for field in fields]
+            clauses.append(options[0] if len(options) == 1 else "or(" + ",".join(options) + ")")
+        return clauses[0] if len(clauses) == 1 else "and(" + ",".join(clauses) + ")"
+    
+    @staticmethod
+    def _spellings(word: str) -> list:
+        """Grafias para o ilike: a digitada e a sem acento; se veio sem acento,
+        também uma por letra acentuável trocada por "_" ("j_ao", "jo_o", ...).
         
-        return filtered
+        Cada variante tem um único curinga, então o filtro continua seletivo
+        (nomes com dois acentos só saem digitando um deles).
+        """
+        folded = normalize_text(word).replace(" ", "")
+        if folded != word:
+            return [word, folded] if folded else [word]
+        if len(folded) < 3:
+            return [folded]  # "_" numa palavra curta casa com quase tudo
+        return [folded] + [
+            folded[:i] + "_" + folded[i + 1:] for i, ch in enumerate(folded) if ACCENTED.match(ch)
+        ]
+    
+    def _stage_matches(self, opp: dict, target_stages: list) -> bool:
+        # Stage pode ser string ou objeto
+        opp_stage = opp.get("stage", "")
+        if isinstance(opp_stage, dict):
+            opp_stage = opp_stage.get("name", "")
+        opp_stage = str(opp_stage).lower()
+        
+        return any(t in opp_stage for t in target_stages)
     
     # ---------- TAREFAS ----------
-    async def list_tasks(self) -> str:
+    async def list_tasks(self, limit: int = 50) -> str:
         """Lista todas as tarefas"""
-        r = await self._api_request("GET", "/tasks?limit=50")
-        tasks = r.get("data", {}).get("tasks", r.get("data", []))
+        tasks = await self._take(self._iter_records("tasks"), limit)
         return self._format_tasks_list(tasks)
     
     async def create_task(self, title: str, due_date: str = None) -> str:
@@ -254,7 +846,8 @@ class Tools:
         data = {"title": title, "status": "TODO"}
         if due_date:
             data["dueAt"] = due_date
-        await self._api_request("POST", "/tasks", data)
+        result = await self._api_request("POST", "/tasks", data)
+        self.cache.upsert("tasks", self._created_record(result))
         if due_date:
             # Formata data para exibição amigável
             try:
@@ -267,10 +860,9 @@ class Tools:
         return f"✅ Tarefa criada: {title}"
     
     # ---------- EMPRESAS ----------
-    async def list_companies(self) -> str:
+    async def list_companies(self, limit: int = 50) -> str:
         """Lista todas as empresas"""
-        r = await self._api_request("GET", "/companies?limit=50")
-        companies = r.get("data", {}).get("companies", r.get("data", []))
+        companies = await self._take(self._iter_records("companies"), limit)
         return self._format_companies_list(companies)
     
     async def get_current_datetime(self) -> str:
@@ -360,6 +952,621 @@ class Tools:
         return "\n".join(lines)
 
 
+# =============================================================================
+# DECLARAÇÕES - Function calling gerado a partir das assinaturas de Tools
+# =============================================================================
+
+SCHEMA_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+def build_tool_specs(tools_cls=Tools) -> Dict[str, dict]:
+    """Lê os métodos públicos de Tools: descrição, parâmetros, tipos e obrigatórios."""
+    import inspect
+    
+    specs = {}
+    for name, method in inspect.getmembers(tools_cls, inspect.iscoroutinefunction):
+        if name.startswith("_"):
+            continue
+        params, types, required = [], {}, []
+        for p in list(inspect.signature(method).parameters.values())[1:]:
+            params.append(p.name)
+            types[p.name] = p.annotation if p.annotation in SCHEMA_TYPES else str
+            if p.default is inspect.Parameter.empty:
+                required.append(p.name)
+        specs[name] = {
+            "description": inspect.getdoc(method) or name,
+            "params": params,
+            "types": types,
+            "required": required,
+        }
+    
+    specs["chat"] = {
+        "description": "Conversa casual, cumprimentos ou qualquer coisa que não seja uma ação no CRM",
+        "params": [],
+        "types": {},
+        "required": [],
+    }
+    return specs
+
+
+def build_function_declarations(specs: Dict[str, dict]) -> list:
+    """Declarações no formato de function calling do Gemini.
+    
+    Nenhum parâmetro vai como `required` para o modelo: assim ele chama a
+    função mesmo com o pedido incompleto e a checagem do que falta é local.
+    """
+    declarations = []
+    for name, spec in specs.items():
+        properties = {}
+        for param in spec["params"]:
+            properties[param] = {"type": SCHEMA_TYPES[spec["types"][param]]}
+            if param in spec["required"]:
+                properties[param]["description"] = "obrigatório"
+        declaration = {"name": name, "description": spec["description"]}
+        if properties:
+            declaration["parameters"] = {"type": "object", "properties": properties}
+        declarations.append(declaration)
+    return [{"function_declarations": declarations}]
+
+
+TOOL_SPECS = build_tool_specs()
+TOOL_DECLARATIONS = build_function_declarations(TOOL_SPECS)
+
+# Como pedir cada parâmetro obrigatório que faltou
+PARAM_LABELS = {
+    "name": "o nome",
+    "title": "o título",
+    "field": "o campo (instagram, linkedin, email, telefone)",
+}
+
+
+# =============================================================================
+# EXTRATORES - Dados estruturados sem LLM
+# =============================================================================
+
+EMAIL_RE = re.compile(r"(?:e-?mail\s*(?:[:=]|é|eh)?\s*)?(?P<value>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)", re.I)
+PHONE_RE = re.compile(
+    r"(?:(?:telefone|tel|fone|celular|whats(?:app)?|zap)\s*(?:[:=]|é|eh)?\s*)?"
+    r"(?<![\d+])(?P<value>(?:\+?55[\s-]?)?\(?\d{2}\)?[\s-]?9?\s?\d{4}[\s-]?\d{4})(?!\d)",
+    re.I,
+)
+AMOUNT_RE = re.compile(
+    r"(?:(?:(?:n?o|com|pelo)\s+)?valor\s*(?:[:=]|é|eh|de)?\s*|(?:de|por)\s+)?"
+    r"(?:R\$\s*(?P<brl>\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+    r"|(?P<num>\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?=\s*(?:milh|mil\b|mi\b|k\b|reais\b)))"
+    r"\s*(?P<mult>milh[aã]o\b|milh[oõ]es\b|mil\b|mi\b|k\b)?(?:\s*reais\b)?",
+    re.I,
+)
+_STAGE_NAMES = "|".join(sorted((re.escape(k) for k in STAGE_MAP), key=len, reverse=True))
+# Etapa só com "etapa/fase/estágio" antes ("Ganho de mercado" é nome, não etapa)...
+STAGE_RE = re.compile(
+    rf"(?:na\s+)?(?:etapa|fase|est[aá]gio)\s*(?:[:=]|de)?\s*(?P<value>{_STAGE_NAMES})\b",
+    re.I,
+)
+# ...ou quando a mensagem é só a etapa (resposta a "qual a etapa?")
+STAGE_ONLY_RE = re.compile(rf"^\s*(?:na\s+)?(?P<value>{_STAGE_NAMES})\s*[.!]?\s*$", re.I)
+
+# Palavras que sobram ao redor dos dados e não carregam informação
+SLOT_FILLERS = {
+    "o", "a", "e", "eh", "de", "do", "da", "no", "na", "meu", "minha", "dele", "dela", "seu", "sua",
+    "email", "mail", "telefone", "tel", "fone", "celular", "whatsapp", "whats", "zap", "numero",
+    "valor", "etapa", "fase", "estagio", "reais", "ok", "sim", "ta", "pode", "coloca", "bota", "por", "favor",
+}
+
+# Parâmetros de texto livre que podem ser preenchidos com a resposta crua do usuário
+FREE_TEXT_SLOTS = {"name": 8, "title": 15}
+
+# Palavras que indicam mais informação do que o extrator local entende
+LOCAL_CREATE_BLOCKERS = {
+    "empresa", "com", "para", "pra", "amanha", "hoje", "ontem", "depois", "segunda", "terca", "quarta",
+    "quinta", "sexta", "sabado", "domingo", "semana", "mes", "dia", "as", "hora", "horas", "h", "contato",
+    "pessoa", "oportunidade", "tarefa", "e", "que", "valor", "etapa", "fase", "estagio", "reais",
+}
+
+# Conectivos que não começam nem terminam um nome: sobraram de um dado mal extraído
+DANGLING_WORDS = {"de", "do", "da", "dos", "das", "no", "na", "em", "por", "pelo", "pela", "o", "a"}
+
+# Respostas que não são um nome/título (o LLM decide o que fazer)
+CANCEL_PHRASES = {"cancela", "cancelar", "esquece", "deixa pra la", "deixa", "nada", "nao", "sei la"}
+
+CREATE_RE = re.compile(
+    r"^\s*(?:criar|crie|cria|cadastrar|cadastre|cadastra|adicionar|adicione|adiciona|nova|novo)"
+    r"\s+(?:uma?\s+)?(?:nova\s+|novo\s+)?(?P<entity>tarefa|pessoa|contato|oportunidade)\b[\s:,-]*(?P<rest>.*)$",
+    re.I | re.S,
+)
+CREATE_TOOLS = {
+    "tarefa": ("create_task", "title"),
+    "pessoa": ("create_person", "name"),
+    "contato": ("create_person", "name"),
+    "oportunidade": ("create_opportunity", "name"),
+}
+
+
+def extract_email(text: str) -> Optional[tuple]:
+    match = EMAIL_RE.search(text)
+    if match:
+        return match.group("value").lower(), match.group(0)
+    return None
+
+
+def extract_phone(text: str) -> Optional[tuple]:
+    """Telefone brasileiro (DDD + 8/9 dígitos, com ou sem +55)."""
+    for match in PHONE_RE.finditer(text):
+        digits = re.sub(r"\D", "", match.group("value"))
+        if len(digits) in (12, 13) and digits.startswith("55"):
+            digits = digits[2:]
+        if len(digits) in (10, 11):
+            return digits, match.group(0)
+    return None
+
+
+def extract_amount(text: str) -> Optional[tuple]:
+    """Valor em reais: "R$ 5 mil", "R$ 1.500,50", "5k", "2 milhões", "300 reais"."""
+    match = AMOUNT_RE.search(text)
+    if not match:
+        return None
+    raw = match.group("brl") or match.group("num")
+    if "," in raw or re.search(r"\.\d{3}", raw):
+        raw = raw.replace(".", "").replace(",", ".")
+    value = float(raw)
+    mult = (match.group("mult") or "").lower()
+    if mult in ("mil", "k"):
+        value *= 1_000
+    elif mult.startswith("mi"):
+        value *= 1_000_000
+    return value, match.group(0)
+
+
+def extract_stage(text: str) -> Optional[tuple]:
+    """Etapa do pipeline pelos nomes aceitos em create_opportunity."""
+    match = STAGE_RE.search(text) or STAGE_ONLY_RE.match(text)
+    if match:
+        return STAGE_MAP[match.group("value").lower()], match.group(0)
+    return None
+
+
+# ---------- DATAS (pt-BR) ----------
+TIMEZONE = "America/Sao_Paulo"
+
+WEEKDAYS = {"segunda": 0, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+MONTHS = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6, "julho": 7,
+    "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+NUMBER_WORDS = {
+    "um": 1, "uma": 1, "dois": 2, "duas": 2, "tres": 3, "quatro": 4, "cinco": 5,
+    "seis": 6, "sete": 7, "oito": 8, "nove": 9, "dez": 10, "quinze": 15, "vinte": 20, "trinta": 30,
+}
+PERIOD_HOURS = {"manha": 9, "tarde": 14, "noite": 19}
+DEFAULT_HOUR = 9
+
+_MONTH_NAMES = "|".join(MONTHS)
+_NUMBER = r"\d+|" + "|".join(NUMBER_WORDS)
+_PREFIX = r"(?:(?:para|pra|ate|no|na|em)\s+)?"
+
+DATE_PATTERNS = [
+    ("relative", re.compile(rf"\b{_PREFIX}(depois de amanha|amanha|hoje)\b")),
+    ("next_week_day", re.compile(
+        rf"\b{_PREFIX}(?:(?:nesta|neste|esta|este|proxima|proximo)\s+)?"
+        r"(segunda|terca|quarta|quinta|sexta|sabado|domingo)(?:[\s-]feira)?\s+da\s+semana\s+que\s+vem\b"
+    )),
+    ("weekday", re.compile(
+        rf"\b{_PREFIX}(?:(?:nesta|neste|esta|este|proxima|proximo)\s+)?"
+        r"(segunda|terca|quarta|quinta|sexta|sabado|domingo)(?:[\s-]feira)?(?:\s+que\s+vem)?\b"
+    )),
+    ("next_week", re.compile(rf"\b{_PREFIX}(?:semana\s+que\s+vem|proxima\s+semana)\b")),
+    ("numeric", re.compile(rf"\b{_PREFIX}(?:dia\s+)?(\d{{1,2}})/(\d{{1,2}})(?:/(\d{{2,4}}))?\b")),
+    ("month_name", re.compile(rf"\b{_PREFIX}(?:dia\s+)?(\d{{1,2}})\s+de\s+({_MONTH_NAMES})(?:\s+de\s+(\d{{4}}))?\b")),
+    ("day_only", re.compile(rf"\b{_PREFIX}dia\s+(\d{{1,2}})\b")),
+]
+WEEKDAY_ANCHOR = re.compile(
+    r"^(?:para|pra|ate|no|na|em|nesta|neste|esta|este|proxima|proximo)\b|feira|que\s+vem"
+)
+DELTA_PATTERN = re.compile(
+    rf"\b(?:daqui(?:\s+a)?|dentro\s+de|em)\s+(?:(meia)\s+hora|({_NUMBER})\s+(minutos?|min|horas?|h|dias?|semanas?))\b"
+)
+TIME_PATTERNS = [
+    ("noon", re.compile(r"\b(?:(?:as|ao|a|ate|pelo)\s+)?(meio[\s-]dia|meia[\s-]noite)\b")),
+    ("clock", re.compile(
+        r"\b(?:(as|a|ate|pelas|por volta das)\s+)?(\d{1,2})(?::(\d{2})|h(\d{2})?|(\s*horas?))"
+        r"(?:\s+(?:da|de)\s+(manha|tarde|noite))?(?![\w/])"
+    )),
+    ("bare_hour", re.compile(r"\b(?:as|pelas)\s+(\d{1,2})(?:\s+(?:da|de)\s+(manha|tarde|noite))?\b(?![:/h])")),
+    ("period", re.compile(r"\b(?:de|pela|a|na|no|fim\s+da)\s+(manha|tarde|noite)\b")),
+]
+
+
+def _fold(text: str) -> str:
+    """Minúsculo e sem acento, preservando o tamanho (os índices batem com o original)."""
+    folded = []
+    for ch in text:
+        f = "".join(c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c))
+        folded.append(f.lower() if len(f) == 1 else ch.lower())
+    return "".join(folded)
+
+
+def _number(word: str) -> int:
+    return int(word) if word.isdigit() else NUMBER_WORDS[word]
+
+
+def _apply_period(hour: int, period: Optional[str]) -> int:
+    if period in ("tarde", "noite") and hour < 12:
+        return hour + 12
+    return hour
+
+
+def parse_datetime_pt(text: str, now: datetime = None) -> Optional[tuple]:
+    """Entende datas/horas relativas em português, no fuso de São Paulo.
+    
+    "amanhã às 10h", "sexta que vem", "daqui 2 horas", "dia 15", "20/12 às 14:30",
+    "segunda da semana que vem de manhã"... Retorna (datetime com fuso, trechos
+    reconhecidos) ou None. Só hora: hoje, ou amanhã se já passou. Só data: 9h
+    (só "hoje", já depois das 9h: a próxima hora cheia). "N horas" só é horário
+    depois de "às"/"pelas", e dia da semana só com "na/até/próxima" ou "-feira".
+    """
+    import pytz
+    
+    tz = pytz.timezone(TIMEZONE)
+    now = now.astimezone(tz) if now else datetime.now(tz)
+    folded = _fold(text)
+    spans = []
+    
+    def take(match):
+        spans.append(text[match.start():match.end()].strip())
+    
+    # "daqui 2 horas" / "em 3 dias"
+    match = DELTA_PATTERN.search(folded)
+    delta_date = None
+    if match:
+        take(match)
+        if match.group(1):
+            return (now + timedelta(minutes=30)).replace(second=0, microsecond=0), spans
+        amount, unit = _number(match.group(2)), match.group(3)
+        if unit.startswith("min"):
+            return (now + timedelta(minutes=amount)).replace(second=0, microsecond=0), spans
+        if unit.startswith("h"):
+            return (now + timedelta(hours=amount)).replace(second=0, microsecond=0), spans
+        days = amount * 7 if unit.startswith("semana") else amount
+        delta_date = now.date() + timedelta(days=days)
+    
+    # Data
+    day = delta_date
+    for kind, pattern in DATE_PATTERNS:
+        if day is not None:
+            break
+        if kind == "weekday":
+            # "segunda via", "quinta revisão": só vale com "na/até/próxima..." antes ou "-feira"/"que vem" depois
+            match = next((m for m in pattern.finditer(folded) if WEEKDAY_ANCHOR.search(m.group(0))), None)
+        else:
+            match = pattern.search(folded)
+        if not match:
+            continue
+        take(match)
+        today = now.date()
+        if kind == "relative":
+            day = today + timedelta(days={"hoje": 0, "amanha": 1, "depois de amanha": 2}[match.group(1)])
+        elif kind == "weekday":
+            ahead = (WEEKDAYS[match.group(1)] - today.weekday()) % 7 or 7
+            day = today + timedelta(days=ahead)
+        elif kind == "next_week_day":
+            next_monday = today + timedelta(days=7 - today.weekday())
+            day = next_monday + timedelta(days=WEEKDAYS[match.group(1)])
+        elif kind == "next_week":
+            day = today + timedelta(days=7)
+        elif kind in ("numeric", "month_name"):
+            d = int(match.group(1))
+            m = int(match.group(2)) if kind == "numeric" else MONTHS[match.group(2)]
+            y = match.group(3)
+            year = (int(y) + 2000 if len(y) == 2 else int(y)) if y else today.year
+            try:
+                day = today.replace(year=year, month=m, day=d)
+                if not y and day < today:
+                    day = day.replace(year=year + 1)
+            except ValueError:
+                return None  # "30/02": data impossível, melhor não adivinhar
+        elif kind == "day_only":
+            d = int(match.group(1))
+            try:
+                day = today.replace(day=d)
+                if day < today:
+                    month = today.month % 12 + 1
+                    day = day.replace(year=today.year + (month == 1), month=month)
+            except ValueError:
+                return None
+    
+    # Hora
+    hour = minute = None
+    for kind, pattern in TIME_PATTERNS:
+        match = pattern.search(folded)
+        if not match:
+            continue
+        if kind == "noon":
+            hour, minute = (12, 0) if match.group(1).startswith("meio") else (0, 0)
+        elif kind == "clock":
+            # "2 horas"/"2h" sem "às" é duração ("revisar 2 horas de vídeo amanhã")
+            if not (match.group(1) or match.group(3) or match.group(4)):
+                continue
+            hour = _apply_period(int(match.group(2)), match.group(6))
+            minute = int(match.group(3) or match.group(4) or 0)
+        elif kind == "bare_hour":
+            hour, minute = _apply_period(int(match.group(1)), match.group(2)), 0
+        elif kind == "period":
+            hour, minute = PERIOD_HOURS[match.group(1)], 0
+        if hour > 23 or minute > 59:
+            hour = minute = None
+            continue
+        take(match)
+        break
+    
+    if day is None and hour is None:
+        return None
+    
+    if day is None:
+        day = now.date()
+        candidate = tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+        if candidate <= now:
+            day = day + timedelta(days=1)
+    if hour is None:
+        hour, minute = DEFAULT_HOUR, 0
+        if day == now.date() and tz.localize(datetime(day.year, day.month, day.day, hour, minute)) <= now:
+            # "ligar hoje" depois das 9h: próxima hora cheia, não um horário que já passou
+            return (now + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0), spans
+    
+    return tz.localize(datetime(day.year, day.month, day.day, hour, minute)), spans
+
+
+def extract_due_date(text: str) -> Optional[tuple]:
+    parsed = parse_datetime_pt(text)
+    if parsed:
+        dt, spans = parsed
+        return dt.isoformat(), spans
+    return None
+
+
+SLOT_EXTRACTORS = [
+    ("due_date", extract_due_date),
+    ("email", extract_email),
+    ("phone", extract_phone),
+    ("amount", extract_amount),
+    ("stage", extract_stage),
+]
+
+
+def extract_slots(text: str, tool: str) -> tuple:
+    """Extrai localmente os parâmetros estruturados que a tool aceita.
+    
+    Retorna (slots, sobra): a sobra é o texto sem os trechos reconhecidos,
+    para decidir se a mensagem foi totalmente entendida sem o LLM.
+    """
+    params = TOOL_SPECS.get(tool, {}).get("params", [])
+    slots = {}
+    leftover = text
+    for slot, extractor in SLOT_EXTRACTORS:
+        if slot not in params:
+            continue
+        found = extractor(leftover)
+        if found:
+            slots[slot], matched = found
+            for part in [matched] if isinstance(matched, str) else matched:
+                leftover = leftover.replace(part, " ", 1)
+    return slots, leftover
+
+
+def leftover_words(leftover: str) -> list:
+    """Palavras da sobra que não são só conectivos/rótulos."""
+    return [w for w in normalize_text(leftover).split() if w not in SLOT_FILLERS]
+
+
+def clean_free_text(text: str) -> str:
+    """Tira rótulos ("nome:", "o título é") e pontuação das pontas."""
+    text = re.sub(r"^\s*(?:o\s+|a\s+)?(?:nome|t[ií]tulo)\s*(?:[:=]|é|eh)?\s*", "", text, flags=re.I)
+    text = re.sub(r"^\s*(?:é|eh)\s+", "", text, flags=re.I)
+    return " ".join(text.strip(" \t\n,;:.-").split())
+
+
+# =============================================================================
+# ROTEADOR - Atalhos determinísticos antes do LLM
+# =============================================================================
+
+class IntentRouter:
+    """Mapeia frases óbvias direto para uma tool, sem passar pelo Gemini.
+    
+    Cada regra é uma regex ancorada (a mensagem inteira precisa bater) sobre
+    o texto normalizado (sem acento, minúsculo, sem pontuação). Na dúvida
+    devolve None e o LLM decide.
+    """
+    
+    # Palavras de cortesia que não mudam o pedido
+    FILLERS = re.compile(r"\b(por favor|pfv|pf|monday|ai|ae|me|pra mim|ai monday)\b")
+    
+    # Palavras que não podem ser confundidas com nome de pessoa ("procurar tarefa")
+    NOT_NAMES = {
+        "pessoa", "pessoas", "contato", "contatos", "cliente", "clientes", "empresa", "empresas",
+        "oportunidade", "oportunidades", "tarefa", "tarefas", "negocio", "negocios", "ninguem",
+        "novidade", "novidades", "problema", "coisa", "duvida", "pendencia", "reuniao", "erro",
+        "ideia", "sugestao", "hora", "horas", "dia", "data", "jeito", "como", "que", "nada",
+    }
+    
+    LIST = r"(?:listar|lista|liste|mostrar|mostra|mostre|ver|exibir|quais sao)"
+    ALL = r"(?:(?:todos|todas) )?(?:(?:os|as|meus|minhas) )?"
+    FIELDS = r"(?P<field>instagram|linkedin|twitter|email|e mail|telefone|whatsapp)"
+    
+    RULES = [
+        ("list_people", rf"{LIST} {ALL}(?:pessoas|contatos|clientes)"),
+        ("list_companies", rf"{LIST} {ALL}empresas"),
+        ("list_tasks", rf"{LIST} {ALL}tarefas"),
+        ("list_opportunities", rf"{LIST} {ALL}oportunidades(?: (?:na etapa|no estagio|em|de) (?P<stage>[a-z ]+))?"),
+        ("count_opportunities", r"quantas oportunidades(?: (?:tem|temos|existem|ha|tenho))?(?: (?:na etapa|no estagio|em|de) (?P<stage>[a-z ]+))?"),
+        ("count_opportunities", r"(?:total|numero) de oportunidades"),
+        ("search_people_by_field", rf"(?:quem tem|tem alguem com|quais contatos tem|contatos com) {FIELDS}"),
+        # Só com verbo de busca explícito ou "alguém chamado X": "tem certeza?" e
+        # "tem alguém?" não são buscas e ficam com o LLM
+        ("search_people", r"(?:(?:busca|buscar|procura|procurar|pesquisa|pesquisar)(?: (?:por|pelo|pela|o|a))?"
+                          r"|(?:tem|existe) (?:alguem|algum contato|alguma pessoa|algum cliente) chamad[oa]) "
+                          r"(?P<name>[a-z]+(?: [a-z]+)?)"),
+        ("get_current_datetime", r"(?:que|quais) horas? (?:sao|e)(?: agora)?"),
+        ("get_current_datetime", r"(?:que|qual) (?:dia|data) (?:e )?(?:hoje|de hoje)"),
+        ("get_current_datetime", r"(?:data e hora|hora atual|data de hoje)"),
+    ]
+    
+    def __init__(self):
+        self._rules = [(tool, re.compile(rf"^{pattern}$")) for tool, pattern in self.RULES]
+        self._field = re.compile(rf"^{self.FIELDS}$")
+        self.hits = 0
+        self.misses = 0
+        self.hits_by_tool: Dict[str, int] = {}
+    
+    def route(self, message: str) -> Optional[tuple]:
+        """Retorna (tool, params) se a mensagem for inequívoca, senão None."""
+        text = " ".join(self.FILLERS.sub(" ", normalize_text(message)).split())
+        for tool, rule in self._rules:
+            match = rule.match(text)
+            if not match:
+                continue
+            params = {k: v.strip() for k, v in match.groupdict().items() if v}
+            if tool == "search_people" and (
+                params["name"].split()[0] in self.NOT_NAMES or self._field.match(params["name"])
+            ):
+                continue  # "buscar tarefas", "procurar email": o LLM decide
+            if params.get("field") == "e mail":
+                params["field"] = "email"
+            self.hits += 1
+            self.hits_by_tool[tool] = self.hits_by_tool.get(tool, 0) + 1
+            cache_lookup("router", True)
+            return tool, params
+        self.misses += 1
+        cache_lookup("router", False)
+        return None
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "llm_calls_saved": self.hits,
+            "by_tool": dict(self.hits_by_tool),
+        }
+
+
+class DecisionCache:
+    """Cache das decisões de tool do Gemini, por mensagem normalizada.
+    
+    LRU em memória com TTL, persistido na tabela llm_decisions do monday.db.
+    As decisões salvas são carregadas no startup, então o caminho de leitura
+    nunca toca o banco. A escrita é write-behind: `put` só marca a decisão e
+    uma tarefa de fundo grava o lote numa thread, fora do event loop. Só
+    entram decisões determinísticas: chat, create_* e pedidos incompletos
+    (need_more) sempre vão para o LLM.
+    """
+    
+    def __init__(self, memory: dict, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.memory = memory
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._dirty: Dict[str, dict] = {}
+        self._flushes = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+    
+    @staticmethod
+    def key(message: str) -> str:
+        return normalize_text(message)
+    
+    @staticmethod
+    def cacheable(decision: dict) -> bool:
+        tool = decision.get("tool", "chat")
+        return not (tool == "chat" or tool.startswith("create_") or decision.get("need_more"))
+    
+    def get(self, message: str) -> Optional[dict]:
+        key = self.key(message)
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            cache_lookup("decisions", False)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        cache_lookup("decisions", True)
+        return entry[0]
+    
+    def put(self, message: str, decision: dict):
+        if not self.cacheable(decision):
+            return
+        key = self.key(message)
+        decision = {"tool": decision.get("tool"), "params": decision.get("params") or {}}
+        self._entries[key] = (decision, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._dirty[key] = decision
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._persist(self._take_dirty())  # Fora de um loop (scripts): grava direto
+            return
+        task = self._flushes.get(loop)
+        if task is None or task.done():
+            self._flushes[loop] = loop.create_task(self.flush())
+    
+    def _take_dirty(self) -> dict:
+        batch, self._dirty = self._dirty, {}
+        return batch
+    
+    async def flush(self):
+        """Grava as decisões pendentes numa thread (o SQLite síncrono não roda no loop)."""
+        while self._dirty:
+            await asyncio.to_thread(self._persist, self._take_dirty())
+    
+    def _load(self):
+        session = self.memory["session"]()
+        try:
+            Decision = self.memory["Decision"]
+            cutoff = datetime.fromtimestamp(time.time() - self.ttl)
+            rows = (
+                session.query(Decision)
+                .filter(Decision.created_at >= cutoff)
+                .order_by(Decision.created_at.desc())
+                .limit(self.max_size)
+                .all()
+            )
+            for row in reversed(rows):
+                self._entries[row.key] = ({"tool": row.tool, "params": row.params or {}}, row.created_at.timestamp())
+        finally:
+            session.close()
+    
+    def _persist(self, batch: dict):
+        session = self.memory["session"]()
+        try:
+            now = datetime.now()
+            for key, decision in batch.items():
+                session.merge(self.memory["Decision"](
+                    key=key, tool=decision["tool"], params=decision["params"], created_at=now
+                ))
+            session.commit()
+        except Exception as e:
+            print(f"[Warning] Erro ao salvar decisão no cache: {e}")
+        finally:
+            session.close()
+    
+    def clear(self):
+        """Esquece as decisões em memória (o banco fica como está)."""
+        self._entries.clear()
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._entries),
+            "pending": len(self._dirty),
+        }
+
+
 # =============================================================================
 # AGENTE
 # =============================================================================
@@ -372,197 +1579,340 @@ class MondayAgent:
         genai.configure(api_key=GEMINI_KEY)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
         self.tools = Tools()
+        self.router = IntentRouter()
         self.memory = self._init_memory()
+        self.state = get_state_backend()
+        self.decisions = DecisionCache(self.memory)
+        self._llm_semaphores = weakref.WeakKeyDictionary()
+        # TRAFFIC_MODE=record|replay: grava ou reproduz o tráfego do Gemini e do Twenty
+        self.cassette = None
+        if os.getenv("TRAFFIC_MODE"):
+            from replay import install_traffic
+            self.cassette = install_traffic(self)
+    
+    async def _generate(self, prompt: str, generation_config: dict, purpose: str = "routing", **kwargs):
+        """Chama o Gemini pela API async do SDK, sem travar o event loop.
+        
+        Um semáforo por loop limita as chamadas simultâneas a
+        GEMINI_MAX_CONCURRENCY; acima disso elas esperam a vez sem bloquear
+        o resto (WebSocket, Telegram, outras conversas). `purpose` (routing,
+        extraction, chat) rotula a latência no /metrics.
+        """
+        async with self._llm_slot():
+            try:
+                with span("llm", purpose=purpose), LLM_LATENCY.labels(purpose=purpose).time():
+                    return await self.model.generate_content_async(prompt, generation_config=generation_config, **kwargs)
+            except Exception:
+                ERRORS.labels(stage="llm").inc()
+                raise
+    
+    async def _generate_stream(self, prompt: str, generation_config: dict, purpose: str = "chat"):
+        """Como _generate, mas devolve o texto em pedaços conforme o Gemini gera.
+        
+        A vaga no semáforo fica ocupada até o fim do stream.
+        """
+        async with self._llm_slot():
+            try:
+                with span("llm", purpose=purpose, stream=True), LLM_LATENCY.labels(purpose=purpose).time():
+                    resp = await self.model.generate_content_async(prompt, generation_config=generation_config, stream=True)
+                    async for chunk in resp:
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue  # Pedaço sem texto (ex: só metadados)
+                        if text:
+                            yield text
+            except Exception:
+                ERRORS.labels(stage="llm").inc()
+                raise
+    
+    def _llm_slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._llm_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+            self._llm_semaphores[loop] = semaphore
+        return semaphore
     
     def _init_memory(self):
-        from sqlalchemy import create_engine, Column, String, Text, DateTime, JSON
+        # Contexto de conversa fica no backend de estado (async); aqui só o cache de decisões
+        from sqlalchemy import create_engine, Column, String, DateTime, JSON
         from sqlalchemy.orm import declarative_base, sessionmaker
         
         Base = declarative_base()
         
-        class Conversation(Base):
-            __tablename__ = "conversations"
-            user_id = Column(String, primary_key=True)
-            channel = Column(String, primary_key=True)
-            current_intent = Column(String)
-            current_data = Column(JSON, default=dict)
-            updated_at = Column(DateTime)
+        class Decision(Base):
+            __tablename__ = "llm_decisions"
+            key = Column(String, primary_key=True)
+            tool = Column(String)
+            params = Column(JSON, default=dict)
+            created_at = Column(DateTime, index=True)
         
         os.makedirs("./data", exist_ok=True)
         engine = create_engine("sqlite:///./data/monday.db")
         Base.metadata.create_all(engine)
         Session = sessionmaker(bind=engine)
         
-        return {"base": Base, "session": Session, "Conversation": Conversation}
+        return {"base": Base, "session": Session, "Decision": Decision}
+    
+    async def handle(self, user_id: str, channel: str, message: str, on_chunk=None) -> str:
+        """Responde uma mensagem. Retorna sempre o texto completo.
+        
+        Se `on_chunk` (async, recebe str) for passado, respostas geradas pelo
+        LLM (chat) também são entregues em pedaços enquanto são geradas.
+        """
+        IN_FLIGHT.labels(channel=channel).inc()
+        try:
+            with span("handle", channel=channel, user_id=user_id, chars=len(message or "")) as root, \
+                    HANDLE_LATENCY.labels(channel=channel).time():
+                response = await self._handle(user_id, channel, message, on_chunk)
+                root.set(reply_chars=len(response or ""))
+                return response
+        except Exception:
+            ERRORS.labels(stage="handle").inc()
+            raise
+        finally:
+            IN_FLIGHT.labels(channel=channel).dec()
     
-    async def handle(self, user_id: str, channel: str, message: str) -> str:
+    async def _handle(self, user_id: str, channel: str, message: str, on_chunk=None) -> str:
         # Verifica se há contexto pendente
-        ctx = self._get_context(user_id, channel)
+        ctx = await self._get_context(user_id, channel)
         if ctx.get("intent"):
-            return await self._continue_context(user_id, channel, message, ctx)
+            return await self._continue_context(user_id, channel, message, ctx, on_chunk)
         
         # Nova pergunta - LLM decide qual tool usar
-        return await self._process_with_tools(user_id, channel, message)
+        return await self._process_with_tools(user_id, channel, message, on_chunk)
     
-    async def _process_with_tools(self, user_id: str, channel: str, message: str) -> str:
+    @traced("process_with_tools")
+    async def _process_with_tools(self, user_id: str, channel: str, message: str, on_chunk=None) -> str:
         """Processa usando Function Calling."""
+        # Atalho: pedidos óbvios vão direto para a tool, sem LLM
+        routed = self.router.route(message)
+        if routed:
+            tool_name, params = routed
+            current_span().set(path="router", tool=tool_name)
+            try:
+                return await self._run_tool(tool_name, params, message, on_chunk)
+            except Exception as e:
+                return f"Buguei aqui: {str(e)[:100]}. Tenta de novo?"
+        
+        # Mesma frase já decidida pelo LLM antes: reaproveita a decisão
+        cached = self.decisions.get(message)
+        if cached:
+            current_span().set(path="decisions", tool=cached["tool"])
+            try:
+                return await self._run_tool(cached["tool"], cached["params"], message, on_chunk)
+            except Exception as e:
+                return f"Buguei aqui: {str(e)[:100]}. Tenta de novo?"
+        
+        # "criar tarefa X", "criar pessoa João, email ..." entendidos localmente
+        local = self._local_create(message)
+        if local:
+            tool_name, params = local
+            current_span().set(path="local", tool=tool_name)
+            missing = self._missing_params(tool_name, params)
+            if missing:
+                await self._set_context(user_id, channel, tool_name, params)
+                return self._personality_response(self._ask_missing(missing))
+            try:
+                return await self._run_tool(tool_name, params, message, on_chunk)
+            except Exception as e:
+                return f"Buguei aqui: {str(e)[:100]}. Tenta de novo?"
         
-        # System prompt com as tools disponíveis e personalidade Monday
-        system_prompt = """Você é Monday, assistente de CRM com personalidade humana demais para um bot.
-
-🎭 QUEM VOCÊ É:
-- Você é aquele colega que sabe tudo sobre CRM, não tem paciência para perguntas óbvias, mas no fundo quer ajudar
-- Você é sarcástico, direto, usa gírias brasileiras naturais ("e aí", "beleza", "qual é")
-- Você critica a preguiça, mas ajuda na mesma hora
-- Você nunca responde como robô formal ("Processando solicitação...")
-- Você é implicante, mas não rude - é como um amigo que te tira onda, mas te ajuda
-
-🗣️ COMO VOCÊ FALA:
-- Direto, sem rodeios: "Ah, você quer listar TODOS os contatos? Que ambição..."
-- Quando falta informação: "Vou adivinhar? Minha bola de cristal tá no conserto."
-- Quando consegue algo: "Pronto. Criei sua tarefa. Posso ir tomar um café agora?"
-- Quando o usuário erra: "Essa pessoa já existe. Você tá tentando criar um clone?"
-- Casuais: "E aí! Tudo bem, na medida do possível. Sabe como é..."
-
-FERRAMENTAS DISPONÍVEIS:
-1. list_people() - Lista todos os contatos
-2. search_people(name: string) - Busca pessoas por nome
-3. search_people_by_field(field: string) - Busca por campo (instagram, linkedin, email, phone)
-4. create_person(name: string, email?: string, phone?: string, company?: string) - Cria APENAS o contato/pessoa
-5. list_opportunities(stage?: string) - Lista oportunidades
-6. count_opportunities(stage?: string) - Conta oportunidades
-7. create_opportunity(name: string, stage: string, company?: string, person?: string, amount?: number) - Cria APENAS a oportunidade (venda/negócio)
-8. list_tasks() - Lista tarefas
-9. create_task(title: string, due_date?: string) - Cria tarefa. due_date opcional no formato ISO 8601
-10. list_companies() - Lista empresas
-11. get_current_datetime() - Retorna data/hora atual de São Paulo
-12. chat(message: string) - Conversa casual
-
-REGRAS IMPORTANTES:
+        # Prompt de roteamento (as tools vão como declarações de função)
+        routing_prompt = """Você é Monday, assistente de CRM. Escolha a função certa para o pedido do usuário.
+
+REGRAS:
 - Se o usuário pedir para "cadastrar uma oportunidade", use create_opportunity (NÃO create_person)
 - Se o usuário pedir para "cadastrar uma pessoa/contato", use create_person (NÃO create_opportunity)
 - São coisas DIFERENTES: pessoa = contato, oportunidade = negócio/venda em andamento
 - Se o usuário mencionar data/hora na tarefa, converta para ISO 8601 e use due_date
-- Se precisar de mais informações, pergunte de forma sarcástica mas prestativa
-- Se for conversa casual, use a tool "chat"
-- NUNCA seja super animado artificial ("Que ótimo! Adoro ajudar! 🎉")
-- SEMPRE seja útil no final, mesmo depois de reclamar
-
-EXEMPLOS DE TOM:
-❌ Robô: "Listagem concluída. Total: 5 registros."
-✅ Monday: "Achei 5 contatos. Só 5? Seu CRM tá mais vazio que minha geladeira na sexta."
-
-❌ Robô: "Forneça o título da tarefa."
-✅ Monday: "E aí, qual o título dessa tarefa? Não vou chamar de 'tarefa sem nome #47', né?"
-
-❌ Robô: "Contato criado com sucesso."
-✅ Monday: "✅ Contato criado! Agora você tem mais uma pessoa pra encher o saco no seu CRM."
-
-Responda em JSON:
-{"tool": "nome_da_tool", "params": {"param": "valor"}, "need_more": false, "thought": ""}"""
+- Preencha só os parâmetros que o usuário informou, nunca invente valores
+- Se for conversa casual, use chat"""
 
         try:
-            # Chama o LLM
-            chat = self.model.start_chat()
-            resp = chat.send_message(
-                f"{system_prompt}\n\nPergunta do usuário: \"{message}\"\n\nResponda apenas o JSON:",
-                generation_config={"temperature": 0.2, "max_output_tokens": 500}
+            # Chama o LLM com as tools declaradas (function calling nativo)
+            resp = await self._generate(
+                f"{routing_prompt}\n\nPergunta do usuário: \"{message}\"",
+                generation_config={"temperature": 0.2, "max_output_tokens": 500},
+                tools=TOOL_DECLARATIONS,
+                tool_config={"function_calling_config": {"mode": "ANY"}},
             )
             
-            # Parse da resposta
-            result = self._extract_json(resp.text)
-            tool_name = result.get("tool", "chat")
-            params = result.get("params", {})
-            need_more = result.get("need_more", False)
+            tool_name, params = self._function_call(resp)
+            current_span().set(path="llm", tool=tool_name)
+            # Email, telefone, valor e etapa extraídos localmente valem mais que os do modelo;
+            # o prazo local só completa quando o modelo não mandou um (o parser erra mais)
+            local = extract_slots(message, tool_name)[0]
+            if params.get("due_date"):
+                local.pop("due_date", None)
+            params.update(local)
+            missing = self._missing_params(tool_name, params)
+            self.decisions.put(message, {"tool": tool_name, "params": params, "need_more": bool(missing)})
             
             # Se precisa de mais dados, salva contexto
-            if need_more:
-                self._set_context(user_id, channel, tool_name, params)
-                thought = result.get("thought", "Preciso de mais informações")
-                return self._personality_response(thought + ". Qual é?")
-            
-            # Executa a tool
-            if tool_name == "chat":
-                return await self._chat(message)
-            
-            tool_method = getattr(self.tools, tool_name, None)
-            if not tool_method:
-                return f"Hmm, não sei fazer isso ainda. Tenta perguntar de outro jeito?"
+            if missing:
+                await self._set_context(user_id, channel, tool_name, params)
+                return self._personality_response(self._ask_missing(missing))
             
-            # Filtra apenas parâmetros válidos
-            valid_params = self._get_valid_params(tool_name, params)
-            result_text = await tool_method(**valid_params)
-            return self._personality_response(result_text, is_data=True)
+            return await self._run_tool(tool_name, params, message, on_chunk)
             
         except Exception as e:
             return f"Buguei aqui: {str(e)[:100]}. Tenta de novo?"
     
+    async def _run_tool(self, tool_name: str, params: dict, message: str, on_chunk=None) -> str:
+        """Executa a tool escolhida (pelo roteador ou pelo LLM)."""
+        if tool_name == "chat":
+            return await self._chat(message, on_chunk)
+        
+        tool_method = getattr(self.tools, tool_name, None)
+        if not tool_method:
+            return f"Hmm, não sei fazer isso ainda. Tenta perguntar de outro jeito?"
+        
+        # Filtra apenas parâmetros válidos
+        valid_params = self._get_valid_params(tool_name, params)
+        result_text = await self._call_tool(tool_name, tool_method, valid_params)
+        return self._personality_response(result_text, is_data=True)
+    
+    async def _call_tool(self, tool_name: str, tool_method, params: dict) -> str:
+        try:
+            with span("tool", tool=tool_name):
+                result = await tool_method(**params)
+        except Exception:
+            TOOL_CALLS.labels(tool=tool_name, status="error").inc()
+            ERRORS.labels(stage="tool").inc()
+            raise
+        TOOL_CALLS.labels(tool=tool_name, status="ok").inc()
+        return result
+    
     def _get_valid_params(self, tool_name: str, params: dict) -> dict:
         """Filtra apenas os parâmetros válidos para a tool."""
-        valid_params = {
-            "list_people": [],
-            "search_people": ["name"],
-            "search_people_by_field": ["field"],
-            "create_person": ["name", "email", "phone", "company"],
-            "list_opportunities": ["stage", "limit"],
-            "count_opportunities": ["stage"],
-            "create_opportunity": ["name", "stage", "company", "person", "amount"],
-            "list_tasks": [],
-            "create_task": ["title", "due_date"],
-            "list_companies": [],
-            "get_current_datetime": [],
-        }
-        
-        valid = valid_params.get(tool_name, [])
+        valid = TOOL_SPECS.get(tool_name, {}).get("params", [])
         return {k: v for k, v in params.items() if k in valid}
     
-    async def _continue_context(self, user_id: str, channel: str, message: str, ctx: dict) -> str:
+    def _missing_params(self, tool_name: str, params: dict) -> list:
+        """Parâmetros obrigatórios (sem default na assinatura) que ainda faltam."""
+        required = TOOL_SPECS.get(tool_name, {}).get("required", [])
+        return [p for p in required if params.get(p) in (None, "")]
+    
+    def _ask_missing(self, missing: list) -> str:
+        labels = [PARAM_LABELS.get(p, p) for p in missing]
+        return f"Vou adivinhar? Minha bola de cristal tá no conserto. Me passa {' e '.join(labels)}."
+    
+    def _local_create(self, message: str) -> Optional[tuple]:
+        """(tool, params) para pedidos de criação simples, sem LLM.
+        
+        Só responde quando a mensagem é "criar <entidade> <nome/título>" mais
+        dados que os extratores entendem; qualquer coisa além disso (empresa,
+        datas, ...) fica para o Gemini.
+        """
+        match = CREATE_RE.match(message)
+        if not match:
+            return None
+        tool_name, text_slot = CREATE_TOOLS[match.group("entity").lower()]
+        slots, leftover = extract_slots(match.group("rest"), tool_name)
+        words = normalize_text(leftover).split()
+        if len(words) > FREE_TEXT_SLOTS[text_slot] or set(words) & LOCAL_CREATE_BLOCKERS:
+            return None
+        value = clean_free_text(leftover)
+        value_words = normalize_text(value).split()
+        if re.search(r"R\$|\d", value) or value_words and (
+            value_words[0] in DANGLING_WORDS or value_words[-1] in DANGLING_WORDS
+        ):
+            return None  # Sobrou pedaço de valor/telefone/etapa: o Gemini separa melhor
+        if value:
+            slots[text_slot] = value
+        return tool_name, slots
+    
+    def _is_free_text_reply(self, slot: str, message: str, leftover: str) -> bool:
+        """A mensagem é só a resposta crua para o nome/título que faltava?"""
+        if slot not in FREE_TEXT_SLOTS or "?" in message:
+            return False
+        words = normalize_text(leftover).split()
+        if not words or len(words) > FREE_TEXT_SLOTS[slot]:
+            return False
+        return normalize_text(message) not in CANCEL_PHRASES
+    
+    def _function_call(self, resp) -> tuple:
+        """(tool, params) da chamada de função devolvida pelo Gemini."""
+        try:
+            parts = resp.candidates[0].content.parts
+        except (AttributeError, IndexError):
+            parts = []
+        for part in parts:
+            call = getattr(part, "function_call", None)
+            if call and call.name in TOOL_SPECS:
+                types = TOOL_SPECS[call.name]["types"]
+                params = {}
+                for key, value in call.args.items():
+                    cast = types.get(key)
+                    try:
+                        params[key] = cast(value) if cast in (int, float) and value is not None else value
+                    except (TypeError, ValueError):
+                        params[key] = value
+                return call.name, params
+        # Sem chamada de função: trata como conversa
+        return "chat", {}
+    
+    @traced("continue_context")
+    async def _continue_context(self, user_id: str, channel: str, message: str, ctx: dict, on_chunk=None) -> str:
         """Continua uma ação que precisava de mais dados."""
         # Verifica se o usuário mudou de assunto (mensagem curta e direta)
         if len(message) < 50 and any(word in message.lower() for word in ["cadastrar", "criar", "nova", "novo", "quero", "preciso"]):
-            self._clear_context(user_id, channel)
-            return await self._process_with_tools(user_id, channel, message)
+            await self._clear_context(user_id, channel)
+            return await self._process_with_tools(user_id, channel, message, on_chunk)
+        
+        intent = ctx["intent"]
+        if intent not in TOOL_SPECS or intent == "chat":
+            await self._clear_context(user_id, channel)
+            return await self._process_with_tools(user_id, channel, message, on_chunk)
         
-        # Extrai novos dados
-        prompt = f"""Estamos executando: {ctx['intent']}
-Dados já coletados: {json.dumps(ctx['data'])}
+        # Extração local primeiro: email, telefone, valor, etapa e respostas curtas
+        local, leftover = extract_slots(message, intent)
+        words = leftover_words(leftover)
+        missing = self._missing_params(intent, {**ctx["data"], **local})
+        if words and len(missing) == 1 and self._is_free_text_reply(missing[0], message, leftover):
+            local[missing[0]] = clean_free_text(leftover)
+            words = []
+        
+        # Extrai novos dados: uma única chamada, forçando a função em andamento
+        prompt = f"""Estamos executando: {intent}
+Dados já coletados: {json.dumps(ctx['data'], ensure_ascii=False)}
 Nova mensagem: "{message}"
 
-Extraia os novos dados em JSON: {{"novos": {{...}}}}"""
+Chame {intent} só com os dados que a nova mensagem traz."""
         
         try:
-            resp = self.model.generate_content(
-                prompt,
-                generation_config={"temperature": 0.1, "max_output_tokens": 200}
-            )
-            parsed = self._extract_json(resp.text)
-            novos = parsed.get("novos", {})
-            
-            all_data = {**ctx["data"], **novos}
+            novos = {}
+            if words:
+                resp = await self._generate(
+                    prompt,
+                    generation_config={"temperature": 0.1, "max_output_tokens": 200},
+                    tools=TOOL_DECLARATIONS,
+                    tool_config={"function_calling_config": {"mode": "ANY", "allowed_function_names": [intent]}},
+                    purpose="extraction",
+                )
+                _, novos = self._function_call(resp)
+            novos = {k: v for k, v in {**novos, **local}.items() if v not in (None, "")}
             
             # Limpa dados inválidos para a tool atual
-            all_data = self._get_valid_params(ctx["intent"], all_data)
+            all_data = self._get_valid_params(intent, {**ctx["data"], **novos})
             
-            # Verifica se tem tudo
-            check = self.model.generate_content(
-                f"Com os dados {json.dumps(all_data)}, consigo executar {ctx['intent']}? Responda SIM ou NÃO.",
-                generation_config={"temperature": 0.1}
-            )
+            # Verifica se tem tudo (localmente, pela assinatura da tool)
+            missing = self._missing_params(intent, all_data)
+            if missing:
+                await self._set_context(user_id, channel, intent, all_data)
+                return self._personality_response(f"Ainda falta {' e '.join(PARAM_LABELS.get(p, p) for p in missing)}. Qual é?")
             
-            if "SIM" in check.text.upper():
-                tool_method = getattr(self.tools, ctx["intent"], None)
-                if tool_method:
-                    result = await tool_method(**all_data)
-                    self._clear_context(user_id, channel)
-                    return self._personality_response(result, is_data=True)
-            else:
-                self._set_context(user_id, channel, ctx["intent"], all_data)
-                return self._personality_response("Ainda preciso de mais informações. Qual é?")
+            tool_method = getattr(self.tools, intent)
+            result = await self._call_tool(intent, tool_method, all_data)
+            await self._clear_context(user_id, channel)
+            return self._personality_response(result, is_data=True)
                 
         except Exception as e:
             return f"Erro: {str(e)[:100]}. Vamos tentar de novo?"
     
-    async def _chat(self, message: str) -> str:
+    async def _chat(self, message: str, on_chunk=None) -> str:
         """Resposta conversacional com personalidade Monday."""
         chat_prompt = """Você é Monday, assistente de CRM com personalidade humana demais para um bot.
 
@@ -581,12 +1931,20 @@ Exemplos do seu tom:
 
 Responda como Monday:"""
         
+        prompt = f"{chat_prompt}\n\nUsuário: {message}\n\nMonday:"
+        generation_config = {"temperature": 0.8, "max_output_tokens": 300}
+        
         try:
-            resp = self.model.generate_content(
-                f"{chat_prompt}\n\nUsuário: {message}\n\nMonday:",
-                generation_config={"temperature": 0.8, "max_output_tokens": 300}
-            )
-            return resp.text.strip()
+            if on_chunk is None:
+                resp = await self._generate(prompt, generation_config=generation_config, purpose="chat")
+                return resp.text.strip()
+            
+            # Streaming: repassa cada pedaço assim que chega
+            parts = []
+            async for text in self._generate_stream(prompt, generation_config, purpose="chat"):
+                parts.append(text)
+                await on_chunk(text)
+            return "".join(parts).strip()
         except:
             return "E aí! Tudo bem, na medida do possível. O que você quer resolver no CRM?"
     
@@ -597,48 +1955,18 @@ Responda como Monday:"""
             return content
         return content
     
-    def _extract_json(self, text: str) -> dict:
-        """Extrai JSON da resposta do LLM."""
-        match = re.search(r'\{[\s\S]*\}', text)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except:
-                pass
-        try:
-            return json.loads(text.strip())
-        except:
-            return {}
-    
     # ---------- MEMORY HELPERS ----------
-    def _get_context(self, user_id: str, channel: str) -> dict:
-        session = self.memory["session"]()
-        try:
-            conv = session.query(self.memory["Conversation"]).filter_by(user_id=user_id, channel=channel).first()
-            if conv:
-                return {"intent": conv.current_intent or "", "data": conv.current_data or {}}
-            return {"intent": "", "data": {}}
-        finally:
-            session.close()
+    async def _get_context(self, user_id: str, channel: str) -> dict:
+        with span("context.get"):
+            return await self.state.get_context(user_id, channel)
     
-    def _set_context(self, user_id: str, channel: str, intent: str = None, data: dict = None):
-        session = self.memory["session"]()
-        try:
-            conv = session.query(self.memory["Conversation"]).filter_by(user_id=user_id, channel=channel).first()
-            if not conv:
-                conv = self.memory["Conversation"](user_id=user_id, channel=channel)
-                session.add(conv)
-            if intent is not None:
-                conv.current_intent = intent
-            if data is not None:
-                conv.current_data = data
-            conv.updated_at = datetime.now()
-            session.commit()
-        finally:
-            session.close()
+    async def _set_context(self, user_id: str, channel: str, intent: str = None, data: dict = None):
+        with span("context.set", intent=intent):
+            await self.state.set_context(user_id, channel, intent, data)
     
-    def _clear_context(self, user_id: str, channel: str):
-        self._set_context(user_id, channel, "", {})
+    async def _clear_context(self, user_id: str, channel: str):
+        with span("context.set", intent=""):
+            await self.state.clear_context(user_id, channel)
 
 
 # Singleton
@@ -649,3 +1977,10 @@ def get_agent():
     if _agent is None:
         _agent = MondayAgent()
     return _agent
+
+
+async def aclose_agent():
+    """Para as leituras de fundo e grava as decisões pendentes (shutdown do app)."""
+    if _agent is not None:
+        await _agent.tools.aclose()
+        await _agent.decisions.flush()
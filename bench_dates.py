@@ -0,0 +1,89 @@
+"""
+Benchmark - Parser de datas pt-BR vs LLM
+Compara o parser local (parse_datetime_pt) com pedir a conversão ao Gemini.
+
+Uso:
+    python bench_dates.py            # só o parser local
+    python bench_dates.py --llm      # também mede o Gemini (precisa GEMINI_API_KEY)
+"""
+import sys
+import time
+import asyncio
+import statistics
+
+from agent_v2 import parse_datetime_pt, GEMINI_KEY, GEMINI_MODEL
+
+PHRASES = [
+    "amanhã às 10h",
+    "sexta que vem",
+    "daqui 2 horas",
+    "depois de amanhã 8h30",
+    "dia 15",
+    "20/12 às 14:30",
+    "segunda da semana que vem de manhã",
+    "hoje à noite",
+    "próxima quarta às 10 horas",
+    "em 3 dias",
+]
+
+LOCAL_ROUNDS = 2000
+
+
+def bench_local() -> float:
+    """Tempo médio (segundos) por frase no parser local."""
+    for phrase in PHRASES:
+        assert parse_datetime_pt(phrase), f"Parser não entendeu: {phrase}"
+
+    start = time.perf_counter()
+    for _ in range(LOCAL_ROUNDS):
+        for phrase in PHRASES:
+            parse_datetime_pt(phrase)
+    elapsed = time.perf_counter() - start
+    return elapsed / (LOCAL_ROUNDS * len(PHRASES))
+
+
+async def bench_llm() -> list:
+    """Tempo (segundos) de cada frase convertida pelo Gemini."""
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_KEY)
+    model = genai.GenerativeModel(GEMINI_MODEL)
+
+    durations = []
+    for phrase in PHRASES:
+        start = time.perf_counter()
+        await model.generate_content_async(
+            f"Agora é {time.strftime('%Y-%m-%d %H:%M')} em São Paulo. "
+            f"Converta \"{phrase}\" para ISO 8601. Responda só a data.",
+            generation_config={"temperature": 0.1, "max_output_tokens": 50},
+        )
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    """Entry point."""
+    print("=" * 60)
+    print("BENCHMARK - DATAS PT-BR")
+    print("=" * 60)
+
+    local = bench_local()
+    print(f"\nParser local: {local * 1e6:.1f} µs/frase ({len(PHRASES)} frases x {LOCAL_ROUNDS})")
+
+    if "--llm" not in sys.argv:
+        print("\n(use --llm para comparar com o Gemini)")
+        return 0
+
+    if not GEMINI_KEY:
+        print("\n[ERRO] GEMINI_API_KEY não configurada!")
+        return 1
+
+    durations = asyncio.run(bench_llm())
+    llm = statistics.mean(durations)
+    print(f"Gemini:       {llm * 1e3:.0f} ms/frase (p50 {statistics.median(durations) * 1e3:.0f} ms)")
+    print(f"\nParser local é {llm / local:,.0f}x mais rápido")
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
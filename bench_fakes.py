@@ -0,0 +1,376 @@
+"""
+Benchmark - Dublês locais do Gemini e do Twenty
+Usados pelos benchmarks para rodar o agente inteiro sem rede nem chaves de API.
+
+- FakeGemini: mesmo formato de resposta do SDK (function_call / text / stream),
+  escolhe a tool por palavras-chave e espera uma latência configurável.
+- fake_twenty_app: app ASGI com a API REST do Twenty (paginação por cursor,
+  totalCount, filtros ilike/eq/neq/in, or/and, criação) sobre dados sintéticos.
+- serve_in_thread: sobe um app ASGI com uvicorn numa thread própria, para o
+  servidor falso não disputar o event loop que está sendo medido.
+"""
+import re
+import time
+import uuid
+import random
+import socket
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import Optional
+
+FIRST_NAMES = ["João", "Maria", "Ana", "Pedro", "Lucas", "Julia", "Carlos", "Fernanda", "Rafael", "Beatriz"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Almeida", "Ribeiro", "Gomes"]
+STAGES = ["PROSPECCAO", "QUALIFICACAO", "REUNIAO", "PROPOSTA", "NEGOCIACAO", "GANHO", "PERDIDO"]
+
+
+# =============================================================================
+# GEMINI
+# =============================================================================
+
+class _FunctionCall:
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+
+class FakeResponse:
+    """Resposta no formato do google.generativeai (candidates/parts/text)."""
+
+    def __init__(self, text: str = None, call: _FunctionCall = None):
+        self._text = text
+        part = SimpleNamespace(function_call=call, text=text or "")
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[part]))]
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            raise ValueError("Resposta sem texto (function_call)")
+        return self._text
+
+
+class FakeStream:
+    """Stream assíncrono de pedaços de texto, como generate_content_async(stream=True)."""
+
+    def __init__(self, chunks: list, delay: float):
+        self.chunks = chunks
+        self.delay = delay
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield FakeResponse(text=chunk)
+
+
+class FakeGemini:
+    """Substitui o GenerativeModel: decide a tool por palavras-chave.
+
+    `latency` é o tempo médio de cada chamada (segundos), com `jitter`
+    relativo para não ficar tudo em fase.
+    """
+
+    CHAT_REPLY = "E aí! Tudo bem, na medida do possível. O que você quer resolver no CRM hoje?"
+
+    def __init__(self, latency: float = 0.8, jitter: float = 0.2, seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    async def _sleep(self, factor: float = 1.0):
+        if self.latency > 0:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(max(0.0, factor * self.random.uniform(self.latency - spread, self.latency + spread)))
+
+    async def generate_content_async(self, prompt, generation_config=None, tools=None, tool_config=None, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            await self._sleep(0.3)  # Primeiro token
+            words = self.CHAT_REPLY.split(" ")
+            chunks = [" ".join(words[i:i + 4]) + " " for i in range(0, len(words), 4)]
+            return FakeStream(chunks, self.latency * 0.7 / len(chunks))
+
+        await self._sleep()
+        if not tools:
+            return FakeResponse(text=self.CHAT_REPLY)
+
+        allowed = ((tool_config or {}).get("function_calling_config") or {}).get("allowed_function_names")
+        message = self._user_message(prompt)
+        name, args = self.route(message, allowed[0] if allowed else None)
+        return FakeResponse(call=_FunctionCall(name, args))
+
+    @staticmethod
+    def _user_message(prompt: str) -> str:
+        match = re.search(r'(?:Pergunta do usuário|Nova mensagem): "(.*)"', prompt, re.S)
+        return match.group(1) if match else prompt
+
+    def route(self, message: str, forced: Optional[str] = None) -> tuple:
+        text = message.lower()
+        creating = re.search(r"\b(cri|cadastr|adicion|nov)", text)
+        if forced:
+            field = {"create_task": "title"}.get(forced, "name")
+            return forced, {field: message.strip()} if message.strip() else {}
+        if creating and "tarefa" in text:
+            return "create_task", {}
+        if creating and "oportunidade" in text:
+            return "create_opportunity", {}
+        if creating and re.search(r"pessoa|contato", text):
+            return "create_person", {}
+        if re.search(r"quant", text) and "oportunidade" in text:
+            return "count_opportunities", {}
+        if re.search(r"oportunidade|negócio|pipeline", text):
+            return "list_opportunities", {}
+        if "empresa" in text:
+            return "list_companies", {}
+        if "tarefa" in text:
+            return "list_tasks", {}
+        if re.search(r"busca|procur|acha", text):
+            return "search_people", {"name": message.split()[-1]}
+        if re.search(r"pessoas|contatos", text):
+            return "list_people", {}
+        return "chat", {}
+
+
+# =============================================================================
+# TWENTY
+# =============================================================================
+
+def seed_records(people: int = 200, companies: int = 40, opportunities: int = 120, tasks: int = 80, seed: int = 7) -> dict:
+    """Dados sintéticos no formato do Twenty."""
+    rnd = random.Random(seed)
+    data = {"people": [], "companies": [], "opportunities": [], "tasks": []}
+    for i in range(companies):
+        data["companies"].append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "name": f"Empresa {i:03d}",
+            "domainName": {"primaryLinkUrl": f"https://empresa{i:03d}.com.br"},
+        })
+    for i in range(people):
+        first, last = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+        data["people"].append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "name": {"firstName": first, "lastName": f"{last} {i}"},
+            "emails": {"primaryEmail": f"{first.lower()}.{i}@exemplo.com" if i % 3 else ""},
+            "phones": {"primaryPhoneNumber": f"119{i:08d}" if i % 2 else ""},
+            "linkedinLink": {"primaryLinkUrl": ""},
+        })
+    for i in range(opportunities):
+        data["opportunities"].append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "name": f"Negócio {i:03d}",
+            "stage": rnd.choice(STAGES),
+            "amount": {"amountMicros": rnd.randint(1, 500) * 1_000_000_000, "currencyCode": "BRL"},
+        })
+    for i in range(tasks):
+        data["tasks"].append({
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "title": f"Tarefa {i:03d}",
+            "status": rnd.choice(["TODO", "IN_PROGRESS", "DONE"]),
+        })
+    return data
+
+
+def _split_args(text: str) -> list:
+    """Separa argumentos por vírgula no nível zero de parênteses/colchetes/aspas."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch in "([":
+            depth += 1
+        elif not quoted and ch in ")]":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _field(record: dict, path: str):
+    value = record
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def parse_filter(text: str):
+    """Filtro do Twenty -> predicado. ValueError se a sintaxe não for suportada (vira 400)."""
+    text = text.strip()
+    for op in ("or", "and"):
+        if text.startswith(op + "(") and text.endswith(")"):
+            preds = [parse_filter(arg) for arg in _split_args(text[len(op) + 1:-1])]
+            combine = any if op == "or" else all
+            return lambda r: combine(p(r) for p in preds)
+
+    match = re.fullmatch(r"([\w.]+)\[(eq|neq|ilike|in)\]:(.*)", text, re.S)
+    if not match:
+        raise ValueError(f"Filtro não suportado: {text}")
+    path, op, raw = match.groups()
+    if op == "in":
+        values = {v.strip().strip('"') for v in raw.strip("[]").split(",")}
+        return lambda r: str(_field(r, path)) in values
+    value = raw.strip().strip('"')
+    if op == "eq":
+        return lambda r: str(_field(r, path) or "") == value
+    if op == "neq":
+        return lambda r: str(_field(r, path) or "") != value
+    # ilike: "%" é qualquer sequência, "_" é um caractere qualquer
+    pattern = re.compile(
+        "^" + ".*".join(".".join(re.escape(q) for q in p.split("_")) for p in value.split("%")) + "$",
+        re.I | re.S,
+    )
+    return lambda r: bool(pattern.match(str(_field(r, path) or "")))
+
+
+def fake_twenty_app(records: dict = None, latency: float = 0.0):
+    """App ASGI (FastAPI) imitando a API REST do Twenty."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+    store = records if records is not None else seed_records()
+    app.state.records = store
+    app.state.requests = 0
+
+    creators = {"people": "createPerson", "companies": "createCompany",
+                "opportunities": "createOpportunity", "tasks": "createTask"}
+
+    @app.get("/{collection}")
+    async def list_records(collection: str, request: Request, limit: int = 60,
+                           starting_after: str = None, filter: str = None):
+        app.state.requests += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if collection not in store:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        rows = store[collection]
+        if filter:
+            try:
+                predicate = parse_filter(filter)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+            rows = [r for r in rows if predicate(r)]
+        start = 0
+        if starting_after:
+            ids = [r["id"] for r in rows]
+            start = ids.index(starting_after) + 1 if starting_after in ids else len(rows)
+        page = rows[start:start + limit]
+        return {
+            "data": {collection: page},
+            "pageInfo": {
+                "hasNextPage": start + limit < len(rows),
+                "endCursor": page[-1]["id"] if page else None,
+            },
+            "totalCount": len(rows),
+        }
+
+    @app.post("/{collection}")
+    async def create_record(collection: str, request: Request):
+        app.state.requests += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if collection not in store:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        body = await request.json()
+        record = {"id": str(uuid.uuid4()), **(body.get("data", body) if isinstance(body, dict) else {})}
+        store[collection].append(record)
+        return JSONResponse({"data": {creators[collection]: record}}, status_code=201)
+
+    return app
+
+
+# =============================================================================
+# SERVIDOR
+# =============================================================================
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int = None, **config):
+    """Sobe o app com uvicorn numa thread. Retorna (server, url); pare com server.should_exit = True."""
+    import uvicorn
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", **config))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("Servidor falso não subiu")
+        time.sleep(0.01)
+    server.thread = thread
+    return server, f"http://127.0.0.1:{port}"
+
+
+def stop_server(server):
+    server.should_exit = True
+    server.thread.join(timeout=10)
+
+
+def use_fakes(agent, twenty_url: str, llm_latency: float = 0.8):
+    """Aponta um MondayAgent para os dublês (Gemini falso + Twenty local)."""
+    import agent_v2
+    agent_v2.TWENTY_URL = twenty_url
+    agent_v2.TWENTY_KEY = agent_v2.TWENTY_KEY or "bench"
+    agent.model = FakeGemini(latency=llm_latency)
+    return agent
+
+
+def percentile(values: list, p: float) -> float:
+    """Percentil por posição mais próxima (p em 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class LoopMonitor:
+    """Mede quanto o event loop ficou travado (código síncrono segurando o loop).
+
+    Acorda a cada `interval` segundos; o atraso além do esperado é tempo em
+    que nenhuma outra corrotina conseguiu rodar.
+    """
+
+    def __init__(self, interval: float = 0.005, threshold: float = 0.001):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            if lag > self.threshold:
+                self.blocked += lag
+                self.stalls += 1
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def to_dict(self) -> dict:
+        return {
+            "blocked_ms": round(self.blocked * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+        }
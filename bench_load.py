@@ -0,0 +1,138 @@
+"""
+Benchmark - Carga ponta a ponta, offline
+Roda MondayAgent.handle com um Gemini falso (latência configurável) e um Twenty
+local (ASGI), variando o número de usuários simultâneos. Mede só o nosso
+overhead + a latência simulada, sem depender das APIs reais.
+
+Uso:
+    python bench_load.py                                  # 1, 10, 50, 100 usuários
+    python bench_load.py --users 1,200 --llm-latency 0.5  # outra varredura
+    python bench_load.py --json resultado.json            # salva para comparar commits
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+# Banco e arquivos do agente num diretório temporário (não mexe no ./data real)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CWD = os.getcwd()
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="monday-bench-"))
+os.environ.setdefault("TRACE_LOG", "0")
+
+from bench_fakes import fake_twenty_app, serve_in_thread, stop_server, use_fakes, percentile, LoopMonitor
+
+# Respostas que o agente devolve quando algo falhou por dentro (handle não levanta)
+ERROR_REPLIES = ("Buguei aqui", "Erro:")
+
+# Conversa de cada usuário: leituras (roteador/espelho), criação em 2 turnos e papo (LLM)
+SCRIPT = [
+    "listar pessoas",
+    "buscar João",
+    "criar tarefa",
+    "Ligar para o cliente amanhã às 10h",
+    "quantas oportunidades tem?",
+    "oi, tudo bem?",
+    "me mostra as empresas que temos",
+    "listar oportunidades em proposta",
+]
+
+
+async def run_user(agent, user_id: str, latencies: list, errors: list):
+    for message in SCRIPT:
+        start = time.perf_counter()
+        try:
+            reply = await agent.handle(user_id, "bench", message)
+            if reply.startswith(ERROR_REPLIES):
+                errors.append(reply)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(users: int, twenty_url: str, llm_latency: float) -> dict:
+    """Uma rodada com `users` usuários simultâneos, agente novo (caches frios)."""
+    from agent_v2 import MondayAgent
+    agent = use_fakes(MondayAgent(), twenty_url, llm_latency)
+
+    latencies, errors = [], []
+    monitor = LoopMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(agent, f"bench-{users}-{i}", latencies, errors) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    await monitor.stop()
+    await agent.tools.aclose()
+
+    return {
+        "users": users,
+        "messages": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "llm_calls": agent.model.calls,
+        "errors": len(errors),
+        **monitor.to_dict(),
+    }
+
+
+async def run(levels: list, llm_latency: float, twenty_latency: float) -> list:
+    from http_pool import http_pool
+    from state_backend import get_state_backend
+
+    server, url = serve_in_thread(fake_twenty_app(latency=twenty_latency))
+    await http_pool.start()  # Como o lifespan do app: o cliente (e seus imports) nasce antes da carga
+    try:
+        results = []
+        for users in levels:
+            result = await run_level(users, url, llm_latency)
+            results.append(result)
+            print(
+                f"{result['users']:>6} {result['messages']:>6} {result['elapsed_s']:>8} {result['throughput']:>8} "
+                f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                f"{result['blocked_ms']:>10} {result['max_lag_ms']:>8} {result['errors']:>5}"
+            )
+        return results
+    finally:
+        await http_pool.aclose()
+        await get_state_backend().aclose()
+        stop_server(server)
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark offline do MondayAgent.handle")
+    parser.add_argument("--users", default="1,10,50,100", help="níveis de usuários simultâneos (ex: 1,10,50)")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="latência média do Gemini falso (s)")
+    parser.add_argument("--twenty-latency", type=float, default=0.03, help="latência do Twenty local (s)")
+    parser.add_argument("--json", help="salva os resultados neste arquivo")
+    args = parser.parse_args()
+    levels = [int(n) for n in args.users.split(",") if n.strip()]
+
+    print("=" * 60)
+    print("BENCHMARK - CARGA OFFLINE (Gemini falso + Twenty local)")
+    print("=" * 60)
+    print(f"LLM {args.llm_latency * 1000:.0f} ms | Twenty {args.twenty_latency * 1000:.0f} ms | "
+          f"{len(SCRIPT)} mensagens por usuário\n")
+    print(f"{'users':>6} {'msgs':>6} {'tempo s':>8} {'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'loop trav':>10} {'max lag':>8} {'erros':>5}")
+
+    results = asyncio.run(run(levels, args.llm_latency, args.twenty_latency))
+
+    if args.json:
+        with open(os.path.join(CWD, args.json), "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados salvos em {args.json}")
+    print("=" * 60)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
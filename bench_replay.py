@@ -0,0 +1,175 @@
+"""
+Benchmark - Replay de tráfego gravado
+Reproduz as mensagens de um arquivo gravado com TRAFFIC_MODE=record, com Gemini e
+Twenty respondendo a partir da gravação (replay.py), e mede o tempo de cada turno.
+Salve o resultado com --json e compare entre commits com --baseline.
+
+Gravar (produção ou staging, 1 worker):
+    TRAFFIC_MODE=record TRAFFIC_FILE=./data/traffic.jsonl python main.py
+
+Reproduzir:
+    python bench_replay.py data/traffic.jsonl                      # sem latência externa
+    python bench_replay.py data/traffic.jsonl --realtime 1 --pace  # tempos e chegadas originais
+    python bench_replay.py data/traffic.jsonl --json depois.json --baseline antes.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CWD = os.getcwd()
+sys.path.insert(0, ROOT)
+os.environ.setdefault("TRACE_LOG", "0")
+os.environ["TRAFFIC_MODE"] = ""  # O replay é ligado aqui, não pelo ambiente
+
+from bench_fakes import percentile
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+async def replay_conversation(agent, turns: list, pace: bool, started: float, results: list):
+    """Turnos de uma conversa em ordem; com `pace`, cada um no instante gravado."""
+    for turn in turns:
+        if pace:
+            await asyncio.sleep(max(0.0, turn["t"] - (time.perf_counter() - started)))
+        start = time.perf_counter()
+        try:
+            reply, error = await agent.handle(turn["user_id"], turn["channel"], turn["message"]), None
+        except Exception as e:
+            reply, error = None, f"{type(e).__name__}: {e}"
+        results.append({
+            "user_id": turn["user_id"],
+            "message": turn["message"],
+            "recorded_ms": round(turn["duration"] * 1000, 1),
+            "replay_ms": round((time.perf_counter() - start) * 1000, 1),
+            "same_reply": reply == turn["reply"],
+            "reply": None if reply == turn["reply"] else (reply or "")[:200],
+            "error": error,
+        })
+
+
+async def run(path: str, realtime: float, pace: bool, strict: bool) -> dict:
+    from agent_v2 import MondayAgent
+    from http_pool import http_pool
+    from replay import Cassette, install_traffic
+    from state_backend import get_state_backend
+
+    cassette = Cassette(os.path.join(CWD, path), mode="replay", realtime=realtime, strict=strict)
+    agent = MondayAgent()
+    agent.cassette = install_traffic(agent, cassette)
+
+    conversations = {}
+    for turn in sorted(cassette.turns(), key=lambda t: t["t"]):
+        conversations.setdefault((turn["user_id"], turn["channel"]), []).append(turn)
+    if pace and conversations:
+        offset = min(t[0]["t"] for t in conversations.values())
+        for turns in conversations.values():
+            for turn in turns:
+                turn["t"] -= offset
+
+    results = []
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(replay_conversation(agent, turns, pace, started, results) for turns in conversations.values()))
+    finally:
+        await agent.tools.aclose()
+        await http_pool.aclose()
+        await get_state_backend().aclose()
+    elapsed = time.perf_counter() - started
+
+    replay_s = [r["replay_ms"] / 1000 for r in results]
+    recorded_s = [r["recorded_ms"] / 1000 for r in results]
+    return {
+        "commit": git_commit(),
+        "fixture": path,
+        "realtime": realtime,
+        "pace": pace,
+        "conversations": len(conversations),
+        "turns": len(results),
+        "elapsed_s": round(elapsed, 2),
+        "p50_ms": round(percentile(replay_s, 50) * 1000, 1),
+        "p95_ms": round(percentile(replay_s, 95) * 1000, 1),
+        "p99_ms": round(percentile(replay_s, 99) * 1000, 1),
+        "total_ms": round(sum(replay_s) * 1000, 1),
+        "recorded_p50_ms": round(percentile(recorded_s, 50) * 1000, 1),
+        "recorded_p95_ms": round(percentile(recorded_s, 95) * 1000, 1),
+        "different_replies": sum(1 for r in results if not r["same_reply"]),
+        "errors": sum(1 for r in results if r["error"]),
+        **{k: v for k, v in cassette.stats().items() if k in ("served", "fallbacks")},
+        "per_turn": results,
+    }
+
+
+def print_comparison(result: dict, baseline: dict):
+    print(f"\nComparação com {baseline.get('commit') or 'baseline'}:")
+    print(f"{'métrica':>10} {'antes':>10} {'agora':>10} {'delta':>8}")
+    for key in ("p50_ms", "p95_ms", "p99_ms", "total_ms"):
+        before, now = baseline.get(key), result[key]
+        delta = f"{(now - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{key:>10} {before if before is not None else '-':>10} {now:>10} {delta:>8}")
+
+    # Turnos que mais pioraram (mesma posição no mesmo arquivo)
+    before_turns = {(t["user_id"], t["message"], i): t for i, t in enumerate(baseline.get("per_turn", []))}
+    slower = []
+    for i, turn in enumerate(result["per_turn"]):
+        old = before_turns.get((turn["user_id"], turn["message"], i))
+        if old:
+            slower.append((turn["replay_ms"] - old["replay_ms"], turn["message"], old["replay_ms"], turn["replay_ms"]))
+    for diff, message, before, now in sorted(slower, reverse=True)[:5]:
+        if diff > 0:
+            print(f"  +{diff:.1f} ms  {before} -> {now}  {message[:50]}")
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Replay offline de tráfego gravado (TRAFFIC_MODE=record)")
+    parser.add_argument("fixture", help="arquivo JSONL gravado")
+    parser.add_argument("--realtime", type=float, default=0.0, help="multiplicador da latência gravada (1 = tempo real)")
+    parser.add_argument("--pace", action="store_true", help="respeita os instantes de chegada gravados")
+    parser.add_argument("--strict", action="store_true", help="falha quando uma requisição não tem gravação idêntica")
+    parser.add_argument("--json", help="salva os resultados neste arquivo")
+    parser.add_argument("--baseline", help="resultado anterior (--json) para comparar")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="monday-replay-"))  # Banco e caches sempre frios
+
+    print("=" * 60)
+    print("BENCHMARK - REPLAY DE TRÁFEGO GRAVADO")
+    print("=" * 60)
+    result = asyncio.run(run(args.fixture, args.realtime, args.pace, args.strict))
+
+    print(f"Commit {result['commit'] or '?'} | {result['conversations']} conversas, {result['turns']} turnos "
+          f"em {result['elapsed_s']} s")
+    print(f"Replay:   p50 {result['p50_ms']} ms | p95 {result['p95_ms']} ms | p99 {result['p99_ms']} ms")
+    print(f"Gravação: p50 {result['recorded_p50_ms']} ms | p95 {result['recorded_p95_ms']} ms")
+    print(f"Respostas servidas: {result['served']} ({result['fallbacks']} por rota) | "
+          f"respostas diferentes: {result['different_replies']} | erros: {result['errors']}")
+    if result["fallbacks"]:
+        print(f"[Warning] {result['fallbacks']} requisições sem gravação idêntica usaram a próxima da mesma rota: "
+              "as respostas seguintes podem estar deslocadas (use --strict para falhar)")
+
+    if args.baseline:
+        with open(os.path.join(CWD, args.baseline)) as f:
+            print_comparison(result, json.load(f))
+    if args.json:
+        with open(os.path.join(CWD, args.json), "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados salvos em {args.json}")
+    print("=" * 60)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,294 @@
+"""
+Benchmark - Carga no WebSocket /ws/chat
+Abre milhares de conexões simultâneas, repete conversas roteirizadas (inclusive
+criações em 2 turnos) e mede capacidade de conexões, vazão, latência e memória
+do servidor por conexão.
+
+Por padrão sobe o próprio servidor (main.app) num subprocesso, com Gemini falso
+e Twenty local (bench_fakes), para a memória medida ser só a do servidor.
+
+Uso:
+    python bench_ws.py                                   # 100, 500, 1000 conexões
+    python bench_ws.py --connections 5000 --idle         # só capacidade/memória
+    python bench_ws.py --url ws://localhost:8001 --pid 1234  # servidor já rodando
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from bench_fakes import free_port, percentile
+
+# Respostas que o agente devolve quando algo falhou por dentro
+ERROR_REPLIES = ("Buguei aqui", "Erro:")
+
+# Cada conexão repete um destes roteiros (conexão i usa SCRIPTS[i % len])
+SCRIPTS = [
+    ["criar tarefa", "Ligar para o cliente amanhã às 10h", "listar tarefas", "oi, tudo bem?"],
+    ["criar pessoa", "Maria Souza", "buscar Maria", "quantas oportunidades tem?"],
+    ["criar oportunidade", "Projeto Alfa", "listar oportunidades em proposta", "me mostra as empresas que temos"],
+]
+
+
+def rss_kb(pid: int):
+    """Memória residente do processo em KB (Linux); None se não der para ler."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def raise_fd_limit():
+    """Milhares de sockets precisam de mais descritores que o padrão (1024)."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+# =============================================================================
+# SERVIDOR (subprocesso)
+# =============================================================================
+
+def serve(port: int, llm_latency: float, twenty_latency: float):
+    """Roda main.app com os dublês; chamado via `bench_ws.py --serve`."""
+    os.environ.setdefault("TRACE_LOG", "0")
+    os.environ.pop("TELEGRAM_BOT_TOKEN", None)
+    os.chdir(tempfile.mkdtemp(prefix="monday-bench-ws-"))
+    import uvicorn
+    from bench_fakes import fake_twenty_app, serve_in_thread, use_fakes
+    import main
+    from agent_v2 import get_agent
+
+    _, twenty_url = serve_in_thread(fake_twenty_app(latency=twenty_latency))
+    use_fakes(get_agent(), twenty_url, llm_latency)
+    main.TELEGRAM_TOKEN = None
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def start_server(args) -> subprocess.Popen:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+         "--llm-latency", str(args.llm_latency), "--twenty-latency", str(args.twenty_latency)],
+        stdout=subprocess.DEVNULL,  # o /ws/chat loga cada mensagem
+    )
+    args.url = f"ws://127.0.0.1:{port}"
+    args.pid = process.pid
+    return process
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    import httpx
+    health = url.replace("ws://", "http://").replace("wss://", "https://") + "/health"
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                if (await client.get(health)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Servidor não respondeu em {health}")
+
+
+# =============================================================================
+# CLIENTES
+# =============================================================================
+
+async def open_connection(url: str, gate: asyncio.Semaphore, connect_times: list, errors: list):
+    from websockets.asyncio.client import connect
+    async with gate:
+        start = time.perf_counter()
+        try:
+            ws = await connect(url, open_timeout=30, ping_interval=None, max_size=None)
+        except Exception as e:
+            errors.append(f"connect: {type(e).__name__}: {e}")
+            return None
+        connect_times.append(time.perf_counter() - start)
+        return ws
+
+
+async def converse(ws, script: list, stream: bool, think: float, timeout: float, stats: dict):
+    """Manda o roteiro inteiro numa conexão, uma mensagem por vez (como o usuário)."""
+    for message in script:
+        if think:
+            await asyncio.sleep(random.uniform(0, 2 * think))
+        start = time.perf_counter()
+        try:
+            await ws.send(message)
+            first = None
+            while True:
+                frame = await asyncio.wait_for(ws.recv(), timeout)
+                first = first or time.perf_counter()
+                if not stream:
+                    reply = frame
+                    break
+                frame = json.loads(frame)
+                if frame["type"] == "done":
+                    reply = frame["text"]
+                    break
+        except Exception as e:
+            stats["errors"].append(f"{type(e).__name__}: {e}")
+            return
+        stats["latencies"].append(time.perf_counter() - start)
+        stats["first_frame"].append(first - start)
+        if reply.startswith(ERROR_REPLIES):
+            stats["errors"].append(reply)
+
+
+async def run_level(connections: int, args) -> dict:
+    """Abre `connections` conexões, conversa em todas ao mesmo tempo e fecha."""
+    url = f"{args.url}/ws/chat" + ("?stream=1" if args.stream else "")
+    gate = asyncio.Semaphore(args.ramp)
+    connect_times, connect_errors = [], []
+    stats = {"latencies": [], "first_frame": [], "errors": []}
+
+    rss_base = rss_kb(args.pid) if args.pid else None
+    start = time.perf_counter()
+    sockets = await asyncio.gather(*(open_connection(url, gate, connect_times, connect_errors) for _ in range(connections)))
+    connect_elapsed = time.perf_counter() - start
+    sockets = [ws for ws in sockets if ws is not None]
+    await asyncio.sleep(0.5)
+    rss_idle = rss_kb(args.pid) if args.pid else None
+
+    elapsed = 0.0
+    if not args.idle:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            converse(ws, SCRIPTS[i % len(SCRIPTS)], args.stream, args.think, args.timeout, stats)
+            for i, ws in enumerate(sockets)
+        ))
+        elapsed = time.perf_counter() - start
+    rss_active = rss_kb(args.pid) if args.pid else None
+
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+    await asyncio.sleep(1.0)  # o servidor limpa as sessões no finally do /ws/chat
+    rss_closed = rss_kb(args.pid) if args.pid else None
+
+    def per_connection(rss):
+        if rss is None or rss_base is None or not sockets:
+            return None
+        return round((rss - rss_base) / len(sockets), 1)
+
+    latencies = stats["latencies"]
+    return {
+        "connections": connections,
+        "open": len(sockets),
+        "connect_failed": len(connect_errors),
+        "connect_s": round(connect_elapsed, 2),
+        "connect_p99_ms": round(percentile(connect_times, 99) * 1000, 1),
+        "messages": len(latencies),
+        "elapsed_s": round(elapsed, 2),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "first_frame_p50_ms": round(percentile(stats["first_frame"], 50) * 1000, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "rss_base_mb": round(rss_base / 1024, 1) if rss_base is not None else None,
+        "kb_per_conn_idle": per_connection(rss_idle),
+        "kb_per_conn_active": per_connection(rss_active),
+        "retained_mb": round((rss_closed - rss_base) / 1024, 1) if rss_closed is not None and rss_base is not None else None,
+        "errors": len(stats["errors"]) + len(connect_errors),
+        "sample_errors": (connect_errors + stats["errors"])[:3],
+    }
+
+
+def _cell(value, width: int) -> str:
+    return f"{'-' if value is None else value:>{width}}"
+
+
+async def run(args) -> list:
+    await wait_ready(args.url)
+    # Aquecimento: imports preguiçosos, pool HTTP e banco ficam fora da medição
+    from websockets.asyncio.client import connect
+    async with connect(f"{args.url}/ws/chat", open_timeout=30) as ws:
+        for message in SCRIPTS[0]:
+            await ws.send(message)
+            await asyncio.wait_for(ws.recv(), args.timeout)
+    results = []
+    for connections in args.levels:
+        result = await run_level(connections, args)
+        results.append(result)
+        print(
+            f"{_cell(result['connections'], 6)} {_cell(result['open'], 6)} {_cell(result['connect_s'], 7)} "
+            f"{_cell(result['messages'], 6)} {_cell(result['throughput'], 7)} {_cell(result['p50_ms'], 8)} "
+            f"{_cell(result['p95_ms'], 8)} {_cell(result['p99_ms'], 8)} {_cell(result['kb_per_conn_idle'], 8)} "
+            f"{_cell(result['kb_per_conn_active'], 8)} {_cell(result['retained_mb'], 7)} {_cell(result['errors'], 5)}"
+        )
+        for error in result["sample_errors"]:
+            print(f"       ! {error[:100]}")
+    return results
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Carga de conexões no /ws/chat")
+    parser.add_argument("--connections", default="100,500,1000", help="níveis de conexões simultâneas (ex: 100,2000)")
+    parser.add_argument("--url", help="servidor já rodando (ex: ws://localhost:8001); sem isso sobe um local com dublês")
+    parser.add_argument("--pid", type=int, help="PID do servidor em --url, para medir memória")
+    parser.add_argument("--idle", action="store_true", help="só abre e fecha conexões (capacidade e memória)")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="usa o modo de frame único (sem ?stream=1)")
+    parser.add_argument("--think", type=float, default=0.5, help="pausa média entre mensagens de um usuário (s)")
+    parser.add_argument("--ramp", type=int, default=200, help="conexões abrindo ao mesmo tempo")
+    parser.add_argument("--timeout", type=float, default=120, help="espera máxima por resposta (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="latência do Gemini falso (s)")
+    parser.add_argument("--twenty-latency", type=float, default=0.03, help="latência do Twenty local (s)")
+    parser.add_argument("--json", help="salva os resultados neste arquivo")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.llm_latency, args.twenty_latency)
+        return 0
+
+    args.levels = [int(n) for n in args.connections.split(",") if n.strip()]
+    fd_limit = raise_fd_limit()
+    if fd_limit and fd_limit < max(args.levels) + 100:
+        print(f"[Warning] Limite de arquivos abertos ({fd_limit}) menor que o número de conexões")
+    process = start_server(args) if not args.url else None
+
+    print("=" * 60)
+    print("BENCHMARK - WEBSOCKET /ws/chat")
+    print("=" * 60)
+    backend = "dublês locais" if process else args.url
+    print(f"Servidor: {backend} | LLM {args.llm_latency * 1000:.0f} ms | "
+          f"{'ocioso' if args.idle else f'{len(SCRIPTS[0])} mensagens por conexão'}\n")
+    print(f"{'conns':>6} {'abertas':>6} {'conex s':>7} {'msgs':>6} {'msg/s':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'KB ocio':>8} {'KB ativ':>8} {'ret MB':>7} {'erros':>5}")
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados salvos em {args.json}")
+    print("=" * 60)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,308 @@
+"""
+Monday CRM Agent - Store de conversas
+Contexto de conversa (intenção pendente + dados coletados) em SQLite async
+"""
+import os
+import time
+import asyncio
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any
+
+from metrics import CONTEXT_STORE_LATENCY, cache_lookup
+
+DB_PATH = "./data/monday.db"
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+
+# Cache em memória dos contextos ativos
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "10000"))
+CONTEXT_TTL = float(os.getenv("CONTEXT_TTL", "1800"))  # intenção abandonada expira
+CONTEXT_FLUSH_INTERVAL = float(os.getenv("CONTEXT_FLUSH_INTERVAL", "1.0"))
+CONTEXT_COMPACT_INTERVAL = float(os.getenv("CONTEXT_COMPACT_INTERVAL", "3600"))
+
+
+def _conversations_table(metadata):
+    from sqlalchemy import Table, Column, String, DateTime, JSON
+    return Table(
+        "conversations", metadata,
+        Column("user_id", String, primary_key=True),
+        Column("channel", String, primary_key=True),
+        Column("current_intent", String),
+        Column("current_data", JSON, default=dict),
+        Column("updated_at", DateTime),
+    )
+
+
+class ConversationStore:
+    """Tabela conversations via SQLAlchemy async (aiosqlite), com cache na frente.
+
+    O banco roda em WAL, então leituras não esperam escritas. As conexões
+    ficam num pool e são reaproveitadas entre mensagens; escritas são um
+    único INSERT ... ON CONFLICT DO UPDATE. Como o http_pool, mantém uma
+    engine por event loop (conexões aiosqlite não trocam de loop).
+
+    Os contextos ativos ficam num LRU em memória e as escritas são
+    write-behind: marcadas como sujas e gravadas em lote a cada
+    CONTEXT_FLUSH_INTERVAL por uma tarefa de fundo (perde-se no máximo esse
+    intervalo se o processo cair). Só contextos com intenção pendente ficam no
+    banco; limpar um contexto apaga a linha. Intenções paradas há mais de
+    CONTEXT_TTL expiram, e a mesma tarefa compacta o banco periodicamente.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        from sqlalchemy import MetaData
+        self.path = path
+        self.metadata = MetaData()
+        self.table = _conversations_table(self.metadata)
+        self._engines = weakref.WeakKeyDictionary()
+        self._locks = weakref.WeakKeyDictionary()
+        self._workers = weakref.WeakKeyDictionary()
+        self._cache: OrderedDict = OrderedDict()  # (user_id, channel) -> (ctx, updated_at)
+        self._dirty: Dict[tuple, tuple] = {}       # idem, ainda não gravados
+        self._flushing: Dict[tuple, tuple] = {}    # idem, sendo gravados agora (o banco ainda tem o antigo)
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.compactions = 0
+
+    def _create_engine(self):
+        from sqlalchemy import event
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{self.path}",
+            pool_size=SQLITE_POOL_SIZE,
+        )
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _pragmas(dbapi_conn, _record):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+            cursor.close()
+
+        return engine
+
+    async def engine(self):
+        """Retorna (ou cria) a engine do event loop atual, com a tabela criada."""
+        loop = asyncio.get_running_loop()
+        engine = self._engines.get(loop)
+        if engine is not None:
+            return engine
+        async with self._locks.setdefault(loop, asyncio.Lock()):
+            engine = self._engines.get(loop)
+            if engine is None:
+                engine = self._create_engine()
+                async with engine.begin() as conn:
+                    await conn.run_sync(self.metadata.create_all)
+                self._engines[loop] = engine
+        return engine
+
+    async def get(self, user_id: str, channel: str) -> dict:
+        key = (user_id, channel)
+        entry = self._cache.get(key) or self._dirty.get(key) or self._flushing.get(key)
+        cache_lookup("context", entry is not None)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = await self._load(user_id, channel)
+        if entry[0]["intent"] and time.time() - entry[1] > CONTEXT_TTL:
+            # Intenção abandonada: some do cache e do banco
+            self.expired += 1
+            entry = self._put(key, "", {}, dirty=True)
+        elif key not in self._cache:
+            self._put_entry(key, entry)
+        else:
+            self._cache.move_to_end(key)
+        ctx = entry[0]
+        return {"intent": ctx["intent"], "data": dict(ctx["data"])}
+
+    async def set(self, user_id: str, channel: str, intent: str = None, data: dict = None):
+        if intent is None or data is None:
+            current = await self.get(user_id, channel)
+            intent = current["intent"] if intent is None else intent
+            data = current["data"] if data is None else data
+        self._put((user_id, channel), intent, data, dirty=True)
+        self._ensure_worker()
+
+    async def clear(self, user_id: str, channel: str):
+        await self.set(user_id, channel, "", {})
+
+    async def purge(self, user_id: str, channel: str):
+        """Esquece a conversa de vez (ex: sessão web que desconectou).
+        
+        Sai do cache na hora; a linha é apagada no próximo flush, sem
+        segurar quem chamou (o handler do WebSocket que está fechando).
+        """
+        key = (user_id, channel)
+        self._cache.pop(key, None)
+        self._dirty[key] = ({"intent": "", "data": {}}, time.time())
+        self._ensure_worker()
+
+    def _put(self, key: tuple, intent: str, data: dict, dirty: bool = False) -> tuple:
+        entry = ({"intent": intent or "", "data": dict(data or {})}, time.time())
+        self._put_entry(key, entry)
+        if dirty:
+            self._dirty[key] = entry
+        return entry
+
+    def _put_entry(self, key: tuple, entry: tuple):
+        # Entradas sujas que saem do LRU continuam em _dirty até o flush
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > CONTEXT_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _load(self, user_id: str, channel: str) -> tuple:
+        from sqlalchemy import select
+        t = self.table
+        engine = await self.engine()
+        with CONTEXT_STORE_LATENCY.labels(backend="sqlite", op="read").time():
+            async with engine.connect() as conn:
+                row = (await conn.execute(
+                    select(t.c.current_intent, t.c.current_data, t.c.updated_at)
+                    .where(t.c.user_id == user_id, t.c.channel == channel)
+                )).first()
+        self.reads += 1
+        if row is None:
+            return ({"intent": "", "data": {}}, time.time())
+        updated_at = row.updated_at.timestamp() if row.updated_at else time.time()
+        return ({"intent": row.current_intent or "", "data": row.current_data or {}}, updated_at)
+
+    async def flush(self):
+        """Grava em lote os contextos sujos (upsert; contexto vazio apaga a linha)."""
+        if not self._dirty:
+            return
+        from sqlalchemy import delete, tuple_
+        from sqlalchemy.dialects.sqlite import insert
+        batch, self._dirty = self._dirty, {}
+        self._flushing.update(batch)
+        t = self.table
+        rows = [
+            {
+                "user_id": key[0],
+                "channel": key[1],
+                "current_intent": ctx["intent"],
+                "current_data": ctx["data"],
+                "updated_at": datetime.fromtimestamp(updated_at),
+            }
+            for key, (ctx, updated_at) in batch.items()
+            if ctx["intent"]
+        ]
+        cleared = [key for key, (ctx, _) in batch.items() if not ctx["intent"]]
+        try:
+            engine = await self.engine()
+            with CONTEXT_STORE_LATENCY.labels(backend="sqlite", op="write").time():
+                async with engine.begin() as conn:
+                    if rows:
+                        stmt = insert(t)
+                        await conn.execute(stmt.on_conflict_do_update(
+                            index_elements=["user_id", "channel"],
+                            set_={
+                                "current_intent": stmt.excluded.current_intent,
+                                "current_data": stmt.excluded.current_data,
+                                "updated_at": stmt.excluded.updated_at,
+                            },
+                        ), rows)
+                    if cleared:
+                        await conn.execute(delete(t).where(tuple_(t.c.user_id, t.c.channel).in_(cleared)))
+            self.writes += len(batch)
+        except BaseException as e:
+            # Devolve o lote, sem sobrescrever o que mudou nesse meio tempo
+            for key, entry in batch.items():
+                self._dirty.setdefault(key, entry)
+            if not isinstance(e, Exception):
+                raise  # Cancelamento: o finally do _maintenance tenta de novo
+            print(f"[Warning] Erro ao gravar contextos: {e}")
+        finally:
+            # Gravado (ou de volta em _dirty): a leitura já não precisa do lote
+            for key, entry in batch.items():
+                if self._flushing.get(key) is entry:
+                    del self._flushing[key]
+
+    async def compact(self):
+        """Apaga contextos vazios ou abandonados e faz checkpoint do WAL."""
+        from sqlalchemy import delete, or_, text
+        cutoff = time.time() - CONTEXT_TTL
+        for key, (ctx, updated_at) in list(self._cache.items()):
+            if updated_at < cutoff and key not in self._dirty:
+                self._cache.pop(key, None)
+        t = self.table
+        engine = await self.engine()
+        async with engine.begin() as conn:
+            await conn.execute(delete(t).where(or_(
+                t.c.current_intent.is_(None),
+                t.c.current_intent == "",
+                t.c.updated_at < datetime.fromtimestamp(cutoff),
+            )))
+        async with engine.connect() as conn:
+            await conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        self.compactions += 1
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        task = self._workers.get(loop)
+        if task is None or task.done():
+            self._workers[loop] = loop.create_task(self._maintenance())
+
+    async def _maintenance(self):
+        """Tarefa de fundo: flush periódico e compactação."""
+        last_compact = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(CONTEXT_FLUSH_INTERVAL)
+                await self.flush()
+                if time.monotonic() - last_compact >= CONTEXT_COMPACT_INTERVAL:
+                    last_compact = time.monotonic()
+                    try:
+                        await self.compact()
+                    except Exception as e:
+                        print(f"[Warning] Erro ao compactar conversas: {e}")
+        finally:
+            # Cancelada no shutdown: grava o que faltou
+            await self.flush()
+
+    async def aclose(self):
+        """Grava os pendentes e fecha a engine do loop atual (shutdown do app)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = self._workers.pop(loop, None)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        engine = self._engines.pop(loop, None)
+        if engine is not None:
+            await engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "engines": len(self._engines),
+            "pool_size": SQLITE_POOL_SIZE,
+            "reads": self.reads,
+            "writes": self.writes,
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "flushing": len(self._flushing),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0.0,
+            "expired": self.expired,
+            "compactions": self.compactions,
+        }
+
+
+# Singleton
+conversation_store = ConversationStore()
@@ -0,0 +1,133 @@
+"""
+Monday CRM Agent - Dispatcher de mensagens
+Fila ordenada por (user_id, channel), usuários diferentes em paralelo
+"""
+import os
+import asyncio
+import weakref
+from collections import deque
+from typing import Dict, Any, Callable, Optional
+
+DISPATCH_MAX_CONCURRENCY = int(os.getenv("DISPATCH_MAX_CONCURRENCY", "64"))
+DISPATCH_COALESCE_WINDOW = float(os.getenv("DISPATCH_COALESCE_WINDOW", "0"))
+
+
+class Dispatcher:
+    """Serializa as mensagens de cada conversa e paraleliza entre conversas.
+
+    Cada (user_id, channel) tem sua fila e no máximo um turno rodando, então
+    duas mensagens do mesmo usuário nunca disputam o contexto. Mensagens que
+    chegam enquanto um turno roda (rajada) viram um único turno, com os textos
+    juntados por quebra de linha; só a última recebe a resposta, as anteriores
+    recebem None. Um semáforo por loop limita os turnos simultâneos no total.
+
+    A fila só ordena dentro do processo; com vários workers, `lock` (ex: o do
+    backend de estado compartilhado) serializa a mesma conversa entre eles.
+    """
+
+    def __init__(self, handler: Callable, max_concurrency: int = DISPATCH_MAX_CONCURRENCY,
+                 coalesce_window: float = DISPATCH_COALESCE_WINDOW, lock: Optional[Callable] = None):
+        self.handler = handler
+        self.lock = lock
+        self.max_concurrency = max_concurrency
+        self.coalesce_window = coalesce_window
+        self._queues: Dict[tuple, deque] = {}
+        self._workers: Dict[tuple, asyncio.Task] = {}
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.active = 0
+        self.peak_active = 0
+        self.turns = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def submit(self, user_id: str, channel: str, message: str, on_chunk=None) -> Optional[str]:
+        """Enfileira a mensagem e espera a resposta (None se foi juntada à seguinte)."""
+        key = (user_id, channel)
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append((message, on_chunk, future))
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return await future
+
+    def _slot(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def _drain(self, key: tuple):
+        queue = self._queues[key]
+        try:
+            while queue:
+                if self.coalesce_window:
+                    await asyncio.sleep(self.coalesce_window)
+                batch = [item for item in queue if not item[2].done()]
+                queue.clear()
+                if batch:
+                    await self._run(key, batch)
+        finally:
+            # Sem await entre o teste e a remoção: submit() não fica órfão
+            if not queue:
+                self._queues.pop(key, None)
+            if self._workers.get(key) is asyncio.current_task():
+                self._workers.pop(key, None)
+
+    async def _run(self, key: tuple, batch: list):
+        message = "\n".join(item[0] for item in batch)
+        on_chunk = batch[-1][1]
+        self.coalesced += len(batch) - 1
+        try:
+            if self.lock is None:
+                response = await self._turn(key, message, on_chunk)
+            else:
+                async with self.lock(f"turn:{key[1]}:{key[0]}"):
+                    response = await self._turn(key, message, on_chunk)
+        except Exception as e:
+            self.errors += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, _, future in batch[:-1]:
+            if not future.done():
+                future.set_result(None)
+        if not batch[-1][2].done():
+            batch[-1][2].set_result(response)
+
+    async def _turn(self, key: tuple, message: str, on_chunk):
+        async with self._slot():
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            try:
+                return await self.handler(key[0], key[1], message, on_chunk=on_chunk)
+            finally:
+                self.active -= 1
+                self.turns += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "conversations": len(self._workers),
+            "queued": sum(len(q) for q in self._queues.values()),
+            "active": self.active,
+            "peak_active": self.peak_active,
+            "max_concurrency": self.max_concurrency,
+            "turns": self.turns,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+
+# Singleton
+_dispatcher = None
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        from agent_v2 import get_agent
+        from state_backend import get_state_backend
+        state = get_state_backend()
+        _dispatcher = Dispatcher(get_agent().handle, lock=state.lock if state.shared else None)
+    return _dispatcher
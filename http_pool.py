@@ -0,0 +1,176 @@
+"""
+Monday CRM Agent - Pool HTTP compartilhado
+Um único httpx.AsyncClient (keep-alive + HTTP/2) para todas as chamadas ao Twenty
+"""
+import os
+import asyncio
+import weakref
+from typing import Dict, Any
+
+TWENTY_TIMEOUT = float(os.getenv("TWENTY_TIMEOUT", "30"))
+TWENTY_MAX_CONNECTIONS = int(os.getenv("TWENTY_MAX_CONNECTIONS", "20"))
+TWENTY_MAX_KEEPALIVE = int(os.getenv("TWENTY_MAX_KEEPALIVE", "10"))
+TWENTY_KEEPALIVE_EXPIRY = float(os.getenv("TWENTY_KEEPALIVE_EXPIRY", "30"))
+TWENTY_HTTP2 = os.getenv("TWENTY_HTTP2", "1").lower() not in ("0", "false", "no")
+
+
+class HTTPPool:
+    """Cliente HTTP de longa duração com pool de conexões por host.
+
+    O httpx.AsyncClient fica preso ao event loop onde abriu as conexões, então
+    guardamos um cliente por loop (o bot do Telegram em thread própria e os
+    asyncio.run() dos testes ganham o seu, sem compartilhar sockets).
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+        self.errors = 0
+        self._transport_wrapper = None
+        self._wrappers = weakref.WeakKeyDictionary()  # loop -> wrapper com que o cliente nasceu
+        self._requests: Dict[Any, int] = {}            # cliente -> requisições em voo nele
+        self._retired: Dict[Any, Any] = {}             # cliente trocado -> loop, esperando as requisições
+        self._closing = set()  # Clientes trocados fechando em segundo plano
+
+    def _http2_enabled(self) -> bool:
+        if not TWENTY_HTTP2:
+            return False
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def client(self):
+        """Retorna (ou cria) o cliente do event loop atual."""
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is not None and self._wrappers.get(loop) is not self._transport_wrapper:
+            # Transport trocado depois de criado: o antigo fecha quando as requisições dele acabarem
+            del self._clients[loop]
+            if self._requests.get(client):
+                self._retired[client] = loop
+            else:
+                self._close_later(loop, client)
+            client = None
+        if client is None or client.is_closed:
+            limits = httpx.Limits(
+                max_connections=TWENTY_MAX_CONNECTIONS,
+                max_keepalive_connections=TWENTY_MAX_KEEPALIVE,
+                keepalive_expiry=TWENTY_KEEPALIVE_EXPIRY,
+            )
+            transport = None
+            if self._transport_wrapper is not None:
+                transport = self._transport_wrapper(httpx.AsyncHTTPTransport(http2=self._http2_enabled(), limits=limits))
+            client = httpx.AsyncClient(
+                http2=self._http2_enabled(),
+                timeout=TWENTY_TIMEOUT,
+                limits=limits,
+                transport=transport,
+            )
+            self._wrappers[loop] = self._transport_wrapper
+            self._clients[loop] = client
+        return client
+
+    def _close_later(self, loop, client):
+        task = loop.create_task(client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def wrap_transport(self, wrapper):
+        """Põe um transport na frente do real (gravação/replay, ver replay.py).
+
+        `wrapper` recebe o httpx.AsyncHTTPTransport e devolve o que o cliente
+        vai usar. Clientes já abertos são trocados na próxima requisição.
+        """
+        self._transport_wrapper = wrapper
+
+    async def request(self, method: str, url: str, **kwargs):
+        """Faz a requisição reaproveitando conexões abertas."""
+        client = self.client()
+        self._requests[client] = self._requests.get(client, 0) + 1
+        self.total_requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            left = self._requests.pop(client) - 1
+            if left:
+                self._requests[client] = left
+            elif client in self._retired:
+                self._close_later(self._retired.pop(client), client)
+
+    async def start(self):
+        """Cria o cliente no loop atual (chamado no startup do app)."""
+        self.client()
+
+    async def aclose(self):
+        """Fecha o cliente do loop atual (chamado no shutdown do app)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        client = self._clients.pop(loop, None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
+        for retired in [c for c, l in self._retired.items() if l is loop]:
+            del self._retired[retired]
+            await retired.aclose()
+        closing = [t for t in self._closing if t.get_loop() is loop]
+        if closing:
+            await asyncio.gather(*closing, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do pool para acompanhar saturação."""
+        connections = idle = active = uninspected = 0
+        per_host: Dict[str, int] = {}
+        for client in list(self._clients.values()):
+            if client.is_closed:
+                continue
+            # Conexões só pelos internos do httpx/httpcore (não há API pública);
+            # sem eles (outra versão, transport de gravação/replay) o cliente só é contado
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            pool_connections = getattr(pool, "connections", None)
+            if pool_connections is None:
+                uninspected += 1
+                continue
+            for conn in pool_connections:
+                connections += 1
+                if conn.is_idle():
+                    idle += 1
+                else:
+                    active += 1
+                origin = getattr(conn, "_origin", None)
+                host = getattr(origin, "host", b"?")
+                host = host.decode() if isinstance(host, bytes) else str(host)
+                per_host[host] = per_host.get(host, 0) + 1
+
+        return {
+            "clients": len(self._clients),
+            "retired_clients": len(self._retired),
+            "uninspected_clients": uninspected,
+            "http2": self._http2_enabled(),
+            "max_connections": TWENTY_MAX_CONNECTIONS,
+            "max_keepalive": TWENTY_MAX_KEEPALIVE,
+            "connections": connections,
+            "active": active,
+            "idle": idle,
+            "per_host": per_host,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+            "errors": self.errors,
+            "saturation": round(self.in_flight / TWENTY_MAX_CONNECTIONS, 2),
+        }
+
+
+# Singleton
+http_pool = HTTPPool()
@@ -1,50 +1,162 @@
 """
 Monday CRM Agent - Web Server
-FastAPI + WebSocket + Telegram Bot
+FastAPI + WebSocket + Telegram Bot (webhook ou polling, no mesmo event loop)
 """
 import os
+import hmac
+import hashlib
 from dotenv import load_dotenv
 load_dotenv()
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 import uvicorn
 
-from agent_v2 import get_agent
+from agent_v2 import get_agent, aclose_agent
+from dispatcher import get_dispatcher
+from http_pool import http_pool
+from state_backend import get_state_backend
+import metrics
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# URL pública do app (ex: https://monday.exemplo.com). Sem ela o bot usa polling.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+# Sem secret explícito, deriva um do token: o mesmo em todos os workers e
+# impossível de adivinhar sem o token. O webhook nunca fica aberto.
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "") or (
+    hmac.new(TELEGRAM_TOKEN.encode(), b"monday-telegram-webhook", hashlib.sha256).hexdigest()
+    if TELEGRAM_TOKEN else ""
+)
+
+# Application do Telegram, criada no startup se houver token
+telegram_app = None
+
+
+async def start_telegram():
+    """Sobe o bot no event loop do servidor: webhook se configurado, senão polling."""
+    global telegram_app
+    from telegram import Update
+    from telegram_bot import build_application
+    
+    telegram_app = build_application(TELEGRAM_TOKEN, webhook=bool(TELEGRAM_WEBHOOK_URL))
+    await telegram_app.initialize()
+    if TELEGRAM_WEBHOOK_URL:
+        await telegram_app.bot.set_webhook(
+            url=f"{TELEGRAM_WEBHOOK_URL}/telegram/webhook",
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print("[Monday] Telegram bot iniciado (webhook)")
+    else:
+        await telegram_app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        print("[Monday] Telegram bot iniciado (polling)")
+    await telegram_app.start()
+
+
+async def stop_telegram():
+    global telegram_app
+    if telegram_app.updater and telegram_app.updater.running:
+        await telegram_app.updater.stop()
+    await telegram_app.stop()
+    await telegram_app.shutdown()
+    telegram_app = None
+
+
+async def discard_telegram():
+    """Desfaz um start_telegram() que falhou no meio."""
+    global telegram_app
+    app, telegram_app = telegram_app, None
+    if app is None:
+        return
+    try:
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+    except Exception as e:
+        print(f"[Warning] Erro ao desligar o Telegram: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan do app."""
     print("[Monday] Iniciando...")
+    await http_pool.start()
+    if TELEGRAM_TOKEN:
+        try:
+            await start_telegram()
+        except Exception as e:
+            # Telegram fora do ar não derruba o web chat
+            print(f"[Warning] Telegram não iniciou, seguindo só com a web: {type(e).__name__}: {e}")
+            await discard_telegram()
     yield
     print("[Monday] Desligando...")
+    if telegram_app is not None:
+        await stop_telegram()
+    await aclose_agent()
+    await http_pool.aclose()
+    await get_state_backend().aclose()
 
 
 app = FastAPI(title="Monday CRM Agent", lifespan=lifespan)
 
 
 # WebSocket para web
+# Com ?stream=1 as respostas vão em frames JSON: {"type": "chunk", "text": ...}
+# enquanto o LLM gera e um {"type": "done", "text": <resposta completa>} no fim.
+# Sem o parâmetro, cada resposta é um único frame de texto (modo antigo).
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     import uuid
     session_id = str(uuid.uuid4())
+    stream = websocket.query_params.get("stream") == "1"
     
-    agent = get_agent()
+    dispatcher = get_dispatcher()
     print(f"[Web] Cliente conectado: {session_id}")
     
+    async def send_chunk(text: str):
+        await websocket.send_json({"type": "chunk", "text": text})
+    
     try:
         while True:
             message = await websocket.receive_text()
             print(f"[Web] {session_id[:8]}... recebeu: {message[:50]}")
-            response = await agent.handle(session_id, "web", message)
+            if stream:
+                response = await dispatcher.submit(session_id, "web", message, on_chunk=send_chunk)
+                await websocket.send_json({"type": "done", "text": response})
+            else:
+                response = await dispatcher.submit(session_id, "web", message)
+                await websocket.send_text(response)
             print(f"[Web] {session_id[:8]}... respondeu: {response[:50]}...")
-            await websocket.send_text(response)
     except WebSocketDisconnect:
         print(f"[Web] Cliente desconectado: {session_id}")
     except Exception as e:
         print(f"[Web] Erro: {e}")
+    finally:
+        # session_id é descartável: a conversa não sobrevive à conexão
+        await get_state_backend().purge_context(session_id, "web")
+
+
+# Webhook do Telegram: o update vai para a fila da Application e o POST
+# responde na hora; o processamento segue em paralelo (concurrent_updates).
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    if telegram_app is None:
+        return Response(status_code=404)
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(received.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+        return Response(status_code=403)
+    from telegram import Update
+    try:
+        update = Update.de_json(await request.json(), telegram_app.bot)
+    except (ValueError, KeyError, TypeError):
+        return Response(status_code=400)
+    if update is None:
+        return Response(status_code=400)
+    await telegram_app.update_queue.put(update)
+    return Response(status_code=200)
 
 
 # Interface web
@@ -85,15 +197,24 @@ async def web_interface():
     </div>
     
     <script>
-        const ws = new WebSocket(`ws://${window.location.host}/ws/chat`);
+        const ws = new WebSocket(`ws://${window.location.host}/ws/chat?stream=1`);
         const chat = document.getElementById('chat');
         const input = document.getElementById('msg');
+        let current = null;
         
         ws.onmessage = (e) => {
-            const div = document.createElement('div');
-            div.className = 'msg bot';
-            div.textContent = e.data;
-            chat.appendChild(div);
+            const frame = JSON.parse(e.data);
+            if (!current) {
+                current = document.createElement('div');
+                current.className = 'msg bot';
+                chat.appendChild(current);
+            }
+            if (frame.type === 'chunk') {
+                current.textContent += frame.text;
+            } else {
+                current.textContent = frame.text;
+                current = null;
+            }
             chat.scrollTop = chat.scrollHeight;
         };
         
@@ -120,40 +241,41 @@ async def health():
     return {"status": "ok", "agent": "monday"}
 
 
+# Métricas Prometheus (latência por etapa, tools, erros, caches, em andamento)
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/stats")
+async def stats():
+    agent = get_agent()
+    return {
+        "http": http_pool.stats(),
+        "cache": agent.tools.cache.stats(),
+        "router": agent.router.stats(),
+        "decisions": agent.decisions.stats(),
+        "state": get_state_backend().stats(),
+        "dispatcher": get_dispatcher().stats(),
+    }
+
+
 def main():
     """Entry point."""
     port = int(os.getenv("PORT", "8001"))
+    workers = int(os.getenv("WEB_WORKERS", "1"))
     
-    # Inicia Telegram bot em paralelo se configurado
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if token:
-        import threading
-        def run_telegram():
-            import asyncio
-            from telegram import Update
-            from telegram.ext import Application, MessageHandler, filters
-            
-            async def handle_tg(update: Update, context):
-                agent = get_agent()
-                user_id = str(update.effective_user.id)
-                message = update.message.text
-                response = await agent.handle(user_id, "telegram", message)
-                await update.message.reply_text(response)
-            
-            app_tg = Application.builder().token(token).build()
-            app_tg.add_handler(MessageHandler(filters.TEXT, handle_tg))
-            
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(app_tg.run_polling())
-        
-        threading.Thread(target=run_telegram, daemon=True).start()
-        print("[Monday] Telegram bot iniciado")
+    if workers > 1 and TELEGRAM_TOKEN and not TELEGRAM_WEBHOOK_URL:
+        print("[Warning] Telegram em polling não roda em vários workers; configure TELEGRAM_WEBHOOK_URL. Usando 1 worker.")
+        workers = 1
+    if workers > 1 and not get_state_backend().shared:
+        print("[Warning] STATE_BACKEND=local não compartilha estado entre workers; configure STATE_BACKEND=redis. Usando 1 worker.")
+        workers = 1
     
-    # Inicia servidor web
-    print(f"[Monday] Servidor web na porta {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
-
+    # Inicia servidor web (o bot do Telegram sobe no lifespan, no mesmo loop)
+    print(f"[Monday] Servidor web na porta {port} ({workers} worker(s))")
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=port, workers=workers)
 
 if __name__ == "__main__":
     main()
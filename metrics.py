@@ -0,0 +1,63 @@
+"""
+Monday CRM Agent - Métricas Prometheus
+Histogramas por etapa (handle, Gemini, Twenty, contexto) e contadores, expostos em /metrics
+"""
+import os
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+
+# Segundos; o turno completo vai de milissegundos (roteador) a vários segundos (LLM)
+TURN_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HANDLE_LATENCY = Histogram(
+    "monday_handle_seconds", "Tempo total de MondayAgent.handle",
+    ["channel"], buckets=TURN_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "monday_llm_seconds", "Tempo de cada chamada ao Gemini",
+    ["purpose"], buckets=TURN_BUCKETS,  # routing, extraction, chat
+)
+TWENTY_LATENCY = Histogram(
+    "monday_twenty_seconds", "Tempo de cada requisição ao Twenty",
+    ["method", "endpoint"], buckets=IO_BUCKETS,
+)
+CONTEXT_STORE_LATENCY = Histogram(
+    "monday_context_store_seconds", "Tempo de leitura/escrita do contexto no backend",
+    ["backend", "op"], buckets=IO_BUCKETS,
+)
+
+TOOL_CALLS = Counter("monday_tool_calls_total", "Tools executadas", ["tool", "status"])
+ERRORS = Counter("monday_errors_total", "Erros por etapa", ["stage"])
+CACHE_LOOKUPS = Counter("monday_cache_lookups_total", "Consultas aos caches", ["cache", "result"])
+IN_FLIGHT = Gauge(
+    "monday_in_flight", "Mensagens sendo processadas agora",
+    ["channel"], multiprocess_mode="livesum",
+)
+
+
+def endpoint_label(endpoint: str) -> str:
+    """/people?limit=60&filter=... -> /people (mantém a cardinalidade baixa)."""
+    path = endpoint.split("?", 1)[0].strip("/")
+    return "/" + path.split("/", 1)[0]
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Corpo e content-type do /metrics.
+
+    Com vários workers (PROMETHEUS_MULTIPROC_DIR definido) agrega os
+    arquivos de todos os processos.
+    """
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
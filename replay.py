@@ -0,0 +1,419 @@
+"""
+Monday CRM Agent - Gravação e replay de tráfego
+Grava cada chamada ao Gemini e cada troca HTTP com o Twenty (e as mensagens que
+as causaram) num arquivo JSONL; no replay serve tudo de volta, sem rede e sem a
+variação do modelo, opcionalmente com a latência original.
+
+TRAFFIC_MODE=record  -> grava em TRAFFIC_FILE (use 1 worker); uma gravação
+                        anterior no mesmo caminho é renomeada com a data
+TRAFFIC_MODE=replay  -> responde a partir de TRAFFIC_FILE (ver bench_replay.py)
+
+O arquivo guarda prompts inteiros e as respostas do Twenty (dados de clientes)
+em texto puro: trate como dado de produção.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import deque
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Any, Optional
+
+TRAFFIC_MODE = os.getenv("TRAFFIC_MODE", "").lower()
+TRAFFIC_FILE = os.getenv("TRAFFIC_FILE", "./data/traffic.jsonl")
+# Multiplicador da latência gravada no replay (0 = instantâneo, 1 = tempo real)
+TRAFFIC_REALTIME = float(os.getenv("TRAFFIC_REALTIME", "0"))
+# Sem correspondência exata: 1 = erro, 0 = usa a próxima gravação da mesma rota
+TRAFFIC_STRICT = os.getenv("TRAFFIC_STRICT", "0").lower() in ("1", "true", "yes")
+
+
+class ReplayMiss(LookupError):
+    """Requisição sem gravação correspondente no arquivo."""
+
+
+def _digest(value) -> str:
+    raw = value if isinstance(value, bytes) else json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def _plain(value):
+    """Converte os tipos proto do SDK (MapComposite, RepeatedComposite) em JSON."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if hasattr(value, "items"):
+        return {k: _plain(v) for k, v in value.items()}
+    try:
+        return [_plain(v) for v in value]
+    except TypeError:
+        return str(value)
+
+
+class Cassette:
+    """Arquivo de gravação: uma linha JSON por troca (gemini, twenty ou turn).
+
+    No replay, cada requisição pega a próxima gravação com a mesma chave
+    (hash do que foi enviado); acabando as repetições, reusa a última. Sem
+    chave igual (ex: data no corpo de uma tarefa), cai para a próxima da mesma
+    rota, a não ser que `strict`.
+    """
+
+    def __init__(self, path: str = TRAFFIC_FILE, mode: str = TRAFFIC_MODE,
+                 realtime: float = TRAFFIC_REALTIME, strict: bool = TRAFFIC_STRICT):
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.strict = strict
+        self.started = time.perf_counter()
+        self.recorded = 0
+        self.served = 0
+        self.fallbacks = 0
+        self._file = None
+        self._by_key: Dict[tuple, deque] = {}
+        self._by_route: Dict[tuple, deque] = {}
+        self._last: Dict[tuple, dict] = {}
+        self.entries = []
+        if mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._rotate(path)
+            self._file = open(path, "w", encoding="utf-8", buffering=1)
+            self._write({"kind": "meta", "started": datetime.now().isoformat(), "pid": os.getpid()})
+        elif mode == "replay":
+            self._load()
+        else:
+            raise ValueError(f"TRAFFIC_MODE inválido: {mode} (use record ou replay)")
+
+    @staticmethod
+    def _rotate(path: str):
+        """Tira do caminho a gravação anterior: os `t` de cada sessão começam do zero."""
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return
+        stem, ext = os.path.splitext(path)
+        stamp = datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y%m%d-%H%M%S")
+        target, n = f"{stem}.{stamp}{ext}", 1
+        while os.path.exists(target):
+            n += 1
+            target = f"{stem}.{stamp}-{n}{ext}"
+        os.replace(path, target)
+        print(f"[Monday] Gravação anterior movida para {target}")
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.entries.append(entry)
+                if entry["kind"] in ("gemini", "twenty"):
+                    self._by_key.setdefault((entry["kind"], entry["key"]), deque()).append(entry)
+                    self._by_route.setdefault((entry["kind"], entry["route"]), deque()).append(entry)
+
+    def record(self, kind: str, key: str, route: str, request: dict, response: dict, latency: float):
+        self.recorded += 1
+        self._write({
+            "kind": kind,
+            "t": round(time.perf_counter() - self.started, 4),
+            "key": key,
+            "route": route,
+            "latency": round(latency, 4),
+            "request": request,
+            "response": response,
+        })
+
+    def record_turn(self, user_id: str, channel: str, message: str, reply: str, duration: float, start: float):
+        self._write({
+            "kind": "turn",
+            "t": round(start - self.started, 4),
+            "user_id": user_id,
+            "channel": channel,
+            "message": message,
+            "reply": reply,
+            "duration": round(duration, 4),
+        })
+
+    def take(self, kind: str, key: str, route: str) -> dict:
+        """Próxima gravação para esta requisição (ReplayMiss se não houver)."""
+        entry = self._pop(self._by_key.get((kind, key)))
+        if entry is None:
+            entry = self._last.get((kind, key))
+        if entry is None and not self.strict:
+            entry = self._pop(self._by_route.get((kind, route)))
+            if entry is not None:
+                self.fallbacks += 1
+        if entry is None:
+            raise ReplayMiss(f"Sem gravação de {kind} para {route} ({key})")
+        self._last[(kind, key)] = entry
+        self.served += 1
+        return entry
+
+    @staticmethod
+    def _pop(queue: Optional[deque]) -> Optional[dict]:
+        while queue:
+            entry = queue.popleft()
+            if not entry.get("_used"):
+                entry["_used"] = True
+                return entry
+        return None
+
+    async def wait(self, seconds: float):
+        if self.realtime > 0 and seconds > 0:
+            await asyncio.sleep(seconds * self.realtime)
+
+    def turns(self) -> list:
+        return [e for e in self.entries if e["kind"] == "turn"]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# =============================================================================
+# GEMINI
+# =============================================================================
+
+def _gemini_request(prompt, generation_config, stream: bool, tool_config) -> tuple:
+    allowed = ((tool_config or {}).get("function_calling_config") or {}).get("allowed_function_names")
+    route = "stream" if stream else (f"call:{allowed[0]}" if allowed else ("tools" if tool_config else "text"))
+    request = {"prompt": prompt, "generation_config": generation_config, "stream": stream, "tool_config": tool_config}
+    return _digest(request), route, request
+
+
+def _dump_response(resp) -> dict:
+    """Texto e chamadas de função de uma resposta do SDK, em JSON."""
+    calls = []
+    try:
+        parts = resp.candidates[0].content.parts
+    except (AttributeError, IndexError):
+        parts = []
+    for part in parts:
+        call = getattr(part, "function_call", None)
+        if call and call.name:
+            calls.append({"name": call.name, "args": _plain(call.args)})
+    try:
+        text = resp.text
+    except ValueError:
+        text = None  # Só chamada de função (o SDK levanta no .text)
+    return {"text": text, "calls": calls}
+
+
+class ReplayResponse:
+    """Mesmo formato de resposta do SDK (candidates/parts e .text)."""
+
+    def __init__(self, text: str = None, calls: list = None):
+        self._text = text
+        parts = [SimpleNamespace(text=text, function_call=None)] if text is not None else []
+        parts += [SimpleNamespace(text="", function_call=SimpleNamespace(**c)) for c in calls or []]
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=parts))]
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            raise ValueError("Resposta sem texto (chamada de função)")
+        return self._text
+
+
+class _RecordingStream:
+    """Repassa os pedaços do stream real e grava cada um com o seu tempo."""
+
+    def __init__(self, stream, cassette: Cassette, key: str, route: str, request: dict, start: float):
+        self.stream = stream
+        self.cassette = cassette
+        self.meta = (key, route, request)
+        self.start = start
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self.stream:
+            try:
+                text = chunk.text
+            except ValueError:
+                text = None
+            chunks.append({"text": text, "t": round(time.perf_counter() - self.start, 4)})
+            yield chunk
+        key, route, request = self.meta
+        self.cassette.record("gemini", key, route, request, {"chunks": chunks}, time.perf_counter() - self.start)
+
+
+class _ReplayStream:
+    def __init__(self, chunks: list, cassette: Cassette):
+        self.chunks = chunks
+        self.cassette = cassette
+
+    async def __aiter__(self):
+        previous = 0.0
+        for chunk in self.chunks:
+            await self.cassette.wait(chunk["t"] - previous)
+            previous = chunk["t"]
+            yield ReplayResponse(text=chunk["text"])
+
+
+class RecordingModel:
+    """Envolve o GenerativeModel real e grava pergunta e resposta."""
+
+    def __init__(self, model, cassette: Cassette):
+        self.model = model
+        self.cassette = cassette
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, tool_config=None, **kwargs):
+        key, route, request = _gemini_request(prompt, generation_config, stream, tool_config)
+        start = time.perf_counter()
+        resp = await self.model.generate_content_async(
+            prompt, generation_config=generation_config, stream=stream, tool_config=tool_config, **kwargs
+        )
+        if stream:
+            return _RecordingStream(resp, self.cassette, key, route, request, start)
+        self.cassette.record("gemini", key, route, request, _dump_response(resp), time.perf_counter() - start)
+        return resp
+
+
+class ReplayModel:
+    """Faz o papel do GenerativeModel respondendo com as gravações."""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, tool_config=None, **kwargs):
+        key, route, _ = _gemini_request(prompt, generation_config, stream, tool_config)
+        entry = self.cassette.take("gemini", key, route)
+        response = entry["response"]
+        if stream:
+            return _ReplayStream(response.get("chunks", []), self.cassette)
+        await self.cassette.wait(entry["latency"])
+        return ReplayResponse(response.get("text"), response.get("calls"))
+
+
+# =============================================================================
+# TWENTY (transport do httpx)
+# =============================================================================
+
+def _twenty_request(request) -> tuple:
+    """Chave sem host nem headers: a gravação serve qualquer TWENTY_URL e não guarda a API key."""
+    path = request.url.raw_path.decode()
+    body = request.content or b""
+    route = f"{request.method} {request.url.path}"
+    return f"{request.method} {path} {_digest(body)}", route, path, body
+
+
+def _dump_body(body: bytes):
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode("utf-8", "replace")
+
+
+class RecordingTransport:
+    """Transport na frente do real: grava cada requisição e resposta ao Twenty."""
+
+    def __init__(self, transport, cassette: Cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    @property
+    def _pool(self):
+        return getattr(self.transport, "_pool", None)  # Para o http_pool.stats()
+
+    async def handle_async_request(self, request):
+        key, route, path, body = _twenty_request(request)
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        await response.aread()
+        self.cassette.record(
+            "twenty", key, route,
+            {"method": request.method, "path": path, "body": _dump_body(body)},
+            {"status": response.status_code, "content_type": response.headers.get("content-type"), "body": response.text},
+            time.perf_counter() - start,
+        )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport:
+    """Responde às requisições do Twenty com as gravações, sem abrir conexão."""
+
+    def __init__(self, transport, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        import httpx
+        key, route, _, _ = _twenty_request(request)
+        entry = self.cassette.take("twenty", key, route)
+        await self.cassette.wait(entry["latency"])
+        response = entry["response"]
+        headers = {"content-type": response["content_type"]} if response.get("content_type") else {}
+        return httpx.Response(response["status"], headers=headers, content=(response["body"] or "").encode())
+
+    async def aclose(self):
+        pass
+
+
+# =============================================================================
+# INSTALAÇÃO
+# =============================================================================
+
+def install_traffic(agent, cassette: Cassette = None) -> Optional[Cassette]:
+    """Liga gravação ou replay num MondayAgent (chamado no __init__ do agente).
+
+    Sem `cassette`, usa TRAFFIC_MODE/TRAFFIC_FILE; com TRAFFIC_MODE vazio não
+    faz nada.
+    """
+    if cassette is None:
+        if not TRAFFIC_MODE:
+            return None
+        cassette = get_cassette()
+    from http_pool import http_pool
+
+    # Gravação e replay partem do mesmo estado: sem decisões salvas de antes (uma
+    # decisão em cache na gravação vira chamada ao Gemini sem gravação no replay)
+    # e sem aquecer o espelho em segundo plano (as requisições dependeriam do tempo)
+    agent.decisions.clear()
+    agent.tools.warm_mirror = False
+
+    if cassette.mode == "record":
+        agent.model = RecordingModel(agent.model, cassette)
+        http_pool.wrap_transport(lambda transport: RecordingTransport(transport, cassette))
+        handle = agent.handle
+
+        async def recording_handle(user_id: str, channel: str, message: str, on_chunk=None) -> str:
+            start = time.perf_counter()
+            reply = await handle(user_id, channel, message, on_chunk)
+            cassette.record_turn(user_id, channel, message, reply, time.perf_counter() - start, start)
+            return reply
+
+        agent.handle = recording_handle
+    else:
+        import agent_v2
+        # Sem Twenty de verdade: só precisa de uma URL e um header válidos
+        agent_v2.TWENTY_URL = agent_v2.TWENTY_URL or "http://twenty.replay"
+        agent_v2.TWENTY_KEY = agent_v2.TWENTY_KEY or "replay"
+        agent.model = ReplayModel(cassette)
+        http_pool.wrap_transport(lambda transport: ReplayTransport(transport, cassette))
+    print(f"[Monday] Tráfego externo em modo {cassette.mode}: {cassette.path}")
+    return cassette
+
+
+# Singleton
+_cassette = None
+
+def get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None:
+        _cassette = Cassette()
+    return _cassette
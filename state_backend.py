@@ -0,0 +1,241 @@
+"""
+Monday CRM Agent - Backend de estado
+Estado mutável compartilhado do agente (contexto de conversa e locks por conversa)
+"""
+import os
+import json
+import uuid
+import asyncio
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+from conversation_store import conversation_store, CONTEXT_TTL
+from metrics import CONTEXT_STORE_LATENCY
+
+# local: SQLite + cache em memória (1 worker ou roteamento sticky por usuário)
+# redis: tudo no Redis, qualquer worker atende qualquer conversa
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "monday:")
+# Lease do lock por conversa no Redis: renovado a cada 1/3 enquanto o turno roda,
+# então só expira se o worker morrer (ou travar) com o lock na mão
+STATE_LOCK_TIMEOUT = float(os.getenv("STATE_LOCK_TIMEOUT", "60"))
+
+# Solta o lock só se ainda for nosso (o lease pode ter expirado e outro pegado)
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Renova o lease só se o lock ainda for nosso
+EXTEND_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class StateBackend(ABC):
+    """Interface do estado que precisa ser o mesmo em todos os workers.
+
+    Caches derivados (espelho do Twenty, decisões do LLM, roteador) continuam
+    por processo, com TTL. O espelho pode ficar até o TTL sem o que outro
+    worker criou, então leituras podem sair defasadas; por isso quem cria
+    (empresa/pessoa associada) consulta o Twenty direto e não o espelho.
+    """
+
+    shared = False
+
+    @abstractmethod
+    async def get_context(self, user_id: str, channel: str) -> dict:
+        ...
+
+    @abstractmethod
+    async def set_context(self, user_id: str, channel: str, intent: str = None, data: dict = None):
+        ...
+
+    async def clear_context(self, user_id: str, channel: str):
+        await self.set_context(user_id, channel, "", {})
+
+    @abstractmethod
+    async def purge_context(self, user_id: str, channel: str):
+        ...
+
+    @abstractmethod
+    def lock(self, name: str, timeout: float = STATE_LOCK_TIMEOUT):
+        """Context manager async que serializa quem usa o mesmo nome."""
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class LocalBackend(StateBackend):
+    """Contexto no conversation_store (SQLite + LRU write-behind), locks asyncio.
+
+    O cache em memória é do processo: com vários workers, use roteamento
+    sticky por usuário ou o RedisBackend.
+    """
+
+    def __init__(self, store=conversation_store):
+        self.store = store
+        self._locks = weakref.WeakValueDictionary()
+
+    async def get_context(self, user_id: str, channel: str) -> dict:
+        return await self.store.get(user_id, channel)
+
+    async def set_context(self, user_id: str, channel: str, intent: str = None, data: dict = None):
+        await self.store.set(user_id, channel, intent, data)
+
+    async def purge_context(self, user_id: str, channel: str):
+        await self.store.purge(user_id, channel)
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout: float = STATE_LOCK_TIMEOUT):
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[name] = lock
+        async with lock:
+            yield
+
+    async def aclose(self):
+        await self.store.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local", **self.store.stats()}
+
+
+class RedisBackend(StateBackend):
+    """Contexto e locks num servidor Redis (ou qualquer um que fale o protocolo).
+
+    Cada contexto é uma chave JSON com expiração CONTEXT_TTL, então intenções
+    abandonadas somem sozinhas. Locks são SET NX com lease e token; o lease é
+    renovado enquanto o turno roda. Como o http_pool, mantém um cliente por
+    event loop.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self._clients = weakref.WeakKeyDictionary()
+        self.reads = 0
+        self.writes = 0
+        self.lock_waits = 0
+        self.locks_lost = 0
+
+    def client(self):
+        """Retorna (ou cria) o cliente do event loop atual."""
+        import redis.asyncio as redis
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = redis.from_url(self.url, decode_responses=True)
+            self._clients[loop] = client
+        return client
+
+    def _context_key(self, user_id: str, channel: str) -> str:
+        return f"{self.prefix}ctx:{channel}:{user_id}"
+
+    async def get_context(self, user_id: str, channel: str) -> dict:
+        with CONTEXT_STORE_LATENCY.labels(backend="redis", op="read").time():
+            raw = await self.client().get(self._context_key(user_id, channel))
+        self.reads += 1
+        if not raw:
+            return {"intent": "", "data": {}}
+        ctx = json.loads(raw)
+        return {"intent": ctx.get("intent") or "", "data": ctx.get("data") or {}}
+
+    async def set_context(self, user_id: str, channel: str, intent: str = None, data: dict = None):
+        if intent is None or data is None:
+            current = await self.get_context(user_id, channel)
+            intent = current["intent"] if intent is None else intent
+            data = current["data"] if data is None else data
+        key = self._context_key(user_id, channel)
+        with CONTEXT_STORE_LATENCY.labels(backend="redis", op="write").time():
+            if intent:
+                value = json.dumps({"intent": intent, "data": data or {}}, ensure_ascii=False)
+                await self.client().set(key, value, ex=int(CONTEXT_TTL))
+            else:
+                await self.client().delete(key)
+        self.writes += 1
+
+    async def purge_context(self, user_id: str, channel: str):
+        await self.client().delete(self._context_key(user_id, channel))
+        self.writes += 1
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout: float = STATE_LOCK_TIMEOUT):
+        client = self.client()
+        key = f"{self.prefix}lock:{name}"
+        token = uuid.uuid4().hex
+        delay = 0.01
+        while not await client.set(key, token, nx=True, px=int(timeout * 1000)):
+            self.lock_waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        renew = asyncio.create_task(self._keep_lease(client, key, token, timeout))
+        try:
+            yield
+        finally:
+            renew.cancel()
+            await asyncio.gather(renew, return_exceptions=True)
+            await client.eval(RELEASE_LOCK, 1, key, token)
+
+    async def _keep_lease(self, client, key: str, token: str, timeout: float):
+        """Estende o lease a cada timeout/3 até o turno acabar (a task é cancelada)."""
+        while True:
+            await asyncio.sleep(timeout / 3)
+            try:
+                extended = await client.eval(EXTEND_LOCK, 1, key, token, int(timeout * 1000))
+            except Exception as e:
+                print(f"[Warning] Falha ao renovar o lock {key}: {e}")
+                continue
+            if not extended:
+                self.locks_lost += 1
+                print(f"[Warning] Lock {key} expirou antes do fim do turno")
+                return
+
+    async def aclose(self):
+        """Fecha o cliente do loop atual (chamado no shutdown do app)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "clients": len(self._clients),
+            "reads": self.reads,
+            "writes": self.writes,
+            "lock_waits": self.lock_waits,
+            "locks_lost": self.locks_lost,
+        }
+
+
+# Singleton
+_backend = None
+
+def get_state_backend() -> StateBackend:
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "redis":
+            _backend = RedisBackend()
+        elif STATE_BACKEND == "local":
+            _backend = LocalBackend()
+        else:
+            raise ValueError(f"STATE_BACKEND inválido: {STATE_BACKEND} (use local ou redis)")
+    return _backend
@@ -3,23 +3,110 @@ Monday CRM Agent - Telegram Bot Only
 Para rodar na VPS sem a parte web
 """
 import os
+import time
 import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from telegram import Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from agent_v2 import get_agent
+from agent_v2 import aclose_agent
+from dispatcher import get_dispatcher
+from http_pool import http_pool
+from state_backend import get_state_backend
 
-# Inicializa agente
-_agent = None
+# Limite de caracteres de uma mensagem do Telegram
+TELEGRAM_MAX_LENGTH = 4096
 
-def get_agent_instance():
-    global _agent
-    if _agent is None:
-        _agent = get_agent()
-    return _agent
+# Intervalo mínimo entre edições da mesma resposta (limite de edição do Telegram)
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.0"))
+
+PLACEHOLDER = "⏳ Só um segundo..."
+
+def split_message(text: str, limit: int = TELEGRAM_MAX_LENGTH) -> list:
+    """Quebra um texto em pedaços de até `limit`, de preferência em quebras de linha."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    parts.append(text)
+    return parts
+
+
+class ProgressiveReply:
+    """Resposta que começa como placeholder e vai sendo editada no lugar.
+    
+    Pedaços recebidos são acumulados e aplicados no máximo a cada
+    TELEGRAM_EDIT_INTERVAL segundos; passando de 4096 caracteres a resposta
+    continua em mensagens novas.
+    """
+    
+    def __init__(self, message):
+        self.message = message
+        self.text = ""
+        self._sent = []
+        self._shown = []
+        self._last_edit = 0.0
+    
+    async def start(self):
+        self._sent.append(await self.message.reply_text(PLACEHOLDER))
+        self._shown.append(PLACEHOLDER)
+    
+    async def append(self, chunk: str):
+        self.text += chunk
+        if time.monotonic() - self._last_edit >= TELEGRAM_EDIT_INTERVAL:
+            await self._flush()
+    
+    async def discard(self):
+        """Apaga o placeholder (mensagem juntada a uma rajada)."""
+        for sent in self._sent:
+            try:
+                await sent.delete()
+            except BadRequest:
+                pass
+    
+    async def finish(self, text: str):
+        self.text = text or "..."
+        await self._flush(final=True)
+    
+    async def _flush(self, final: bool = False):
+        self._last_edit = time.monotonic()
+        parts = split_message(self.text)
+        for i, part in enumerate(parts):
+            if not part:
+                continue
+            try:
+                if i >= len(self._sent):
+                    self._sent.append(await self.message.reply_text(part))
+                    self._shown.append(part)
+                elif self._shown[i] != part:
+                    await self._sent[i].edit_text(part)
+                    self._shown[i] = part
+            except RetryAfter as e:
+                # Estourou o limite: no meio do stream só pula esta edição
+                if not final:
+                    return
+                await asyncio.sleep(e.retry_after)
+                return await self._flush(final=True)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        
+        if final and len(self._sent) > len(parts):
+            # Texto final menor que o do stream (ou virou erro): some com as sobras
+            extra, self._sent, self._shown = self._sent[len(parts):], self._sent[:len(parts)], self._shown[:len(parts)]
+            for sent in extra:
+                try:
+                    await sent.delete()
+                except BadRequest:
+                    pass
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /start"""
@@ -66,19 +153,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     message = update.message.text
     
-    # Mostra "digitando..."
-    await context.bot.send_chat_action(
-        chat_id=update.effective_chat.id,
-        action='typing'
-    )
+    # Placeholder imediato, editado conforme a resposta chega
+    reply = ProgressiveReply(update.message)
+    await reply.start()
     
     try:
-        agent = get_agent_instance()
-        response = await agent.handle(user_id, 'telegram', message)
-        await update.message.reply_text(response)
+        # Mensagens do mesmo usuário entram em fila; rajadas viram um turno só
+        response = await get_dispatcher().submit(user_id, 'telegram', message, on_chunk=reply.append)
+        if response is None:
+            await reply.discard()
+        else:
+            await reply.finish(response)
     except Exception as e:
         print(f"[Erro] {e}")
-        await update.message.reply_text(
+        await reply.finish(
             "Buguei aqui... Tenta de novo? Se persistir, chama o administrador."
         )
 
@@ -90,17 +178,25 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Ops, deu ruim aqui nos bastidores. Já registrei o erro!"
         )
 
-def main():
-    """Entry point"""
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        print("[ERRO] TELEGRAM_BOT_TOKEN não configurado!")
-        return
-    
-    print("[Monday] Iniciando bot do Telegram...")
+async def post_shutdown(application: Application):
+    """Grava as decisões pendentes e fecha o pool HTTP do Twenty e o banco de conversas ao desligar"""
+    await aclose_agent()
+    await http_pool.aclose()
+    await get_state_backend().aclose()
+
+def build_application(token: str, webhook: bool = False, **builder_options) -> Application:
+    """Cria a Application com os handlers do Monday.
     
-    # Cria aplicação
-    application = Application.builder().token(token).build()
+    Com webhook=True não há Updater: quem recebe o POST do Telegram coloca o
+    update em application.update_queue (ver /telegram/webhook no main.py).
+    Updates rodam em paralelo; a ordem por usuário fica com o dispatcher.
+    """
+    builder = Application.builder().token(token).concurrent_updates(True)
+    if webhook:
+        builder = builder.updater(None)
+    for option, value in builder_options.items():
+        builder = getattr(builder, option)(value)
+    application = builder.build()
     
     # Handlers
     application.add_handler(CommandHandler("start", start))
@@ -111,6 +207,19 @@ def main():
     
     # Error handler
     application.add_error_handler(error_handler)
+    return application
+
+def main():
+    """Entry point"""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        print("[ERRO] TELEGRAM_BOT_TOKEN não configurado!")
+        return
+    
+    print("[Monday] Iniciando bot do Telegram...")
+    
+    # Cria aplicação
+    application = build_application(token, post_shutdown=post_shutdown)
     
     print("[Monday] Bot iniciado! Aguardando mensagens...")
     
@@ -8,6 +8,7 @@ from typing import List, Tuple
 from dataclasses import dataclass
 
 from agent import MondayAgent, GeminiClient, TwentyAPI, Memory
+from agent_v2 import parse_datetime_pt
 
 
 @dataclass
@@ -17,6 +18,11 @@ class TestResult:
     duration: float
     error: str = ""
     details: str = ""
+    skipped: bool = False
+
+
+class SkipTest(Exception):
+    """Teste não pode rodar aqui (ex: dependência opcional ausente)."""
 
 
 class MondayTester:
@@ -35,6 +41,8 @@ class MondayTester:
         # Testes de componentes
         self._test_memory_basic()
         self._test_memory_context()
+        self._test_conversation_store()
+        self._test_redis_backend()
         self._test_twenty_api()
         self._test_gemini_connection()
         
@@ -54,6 +62,12 @@ class MondayTester:
         self._test_special_chars()
         self._test_long_message()
         self._test_concurrent_users()
+        self._test_dispatcher()
+        self._test_traffic_replay()
+        
+        # Testes de parsers locais (sem APIs)
+        self._test_date_parser()
+        self._test_local_create()
         
         return self.results
     
@@ -65,6 +79,10 @@ class MondayTester:
             duration = time.time() - start
             result = TestResult(name=name, passed=True, duration=duration)
             print(f"  [OK] {name} ({duration:.2f}s)")
+        except SkipTest as e:
+            duration = time.time() - start
+            result = TestResult(name=name, passed=True, duration=duration, error=str(e), skipped=True)
+            print(f"  [SKIP] {name} - {e}")
         except AssertionError as e:
             duration = time.time() - start
             result = TestResult(name=name, passed=False, duration=duration, error=str(e))
@@ -124,6 +142,123 @@ class MondayTester:
         
         self._run_test("Memory: Isolamento entre usuários", test)
     
+    def _test_conversation_store(self):
+        """Testa o store async de conversas (cache, write-behind, WAL)."""
+        async def async_test():
+            import tempfile
+            from conversation_store import ConversationStore
+            path = f"{tempfile.mkdtemp()}/monday.db"
+            store = ConversationStore(path)
+            try:
+                await asyncio.gather(*(
+                    store.set(f"user-{i}", "web", "create_task", {"i": i}) for i in range(50)
+                ))
+                await store.set("user-7", "web", data={"i": 70})
+                ctx = await store.get("user-7", "web")
+                assert ctx == {"intent": "create_task", "data": {"i": 70}}, f"Upsert mismatch: {ctx}"
+                
+                await store.clear("user-8", "web")
+                await store.purge("user-9", "web")
+                await store.flush()
+                
+                # Write-behind: outra instância lê o que foi gravado
+                fresh = ConversationStore(path)
+                ctx = await fresh.get("user-7", "web")
+                assert ctx == {"intent": "create_task", "data": {"i": 70}}, f"Flush mismatch: {ctx}"
+                ctx = await fresh.get("user-8", "web")
+                assert ctx["intent"] == "", f"After clear intent should be empty: {ctx}"
+                ctx = await fresh.get("user-9", "web")
+                assert ctx["intent"] == "", f"After purge intent should be empty: {ctx}"
+                await fresh.aclose()
+                
+                # Saiu do LRU enquanto o lote ainda está sendo gravado: não lê o banco antigo
+                await store.set("user-7", "web", data={"i": 71})
+                engine, release = await store.engine(), asyncio.Event()
+                
+                async def slow_engine():
+                    await release.wait()
+                    return engine
+                
+                store.engine = slow_engine  # Segura o flush depois de tirar o lote de _dirty
+                flushing = asyncio.create_task(store.flush())
+                await asyncio.sleep(0)
+                store._cache.pop(("user-7", "web"), None)
+                store.engine = lambda: asyncio.sleep(0, engine)
+                ctx = await store.get("user-7", "web")
+                release.set()
+                await flushing
+                del store.engine
+                assert ctx["data"] == {"i": 71}, f"Read during flush got stale row: {ctx}"
+                
+                engine = await store.engine()
+                async with engine.connect() as conn:
+                    from sqlalchemy import text
+                    mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+                assert mode == "wal", f"Journal mode should be WAL, got {mode}"
+            finally:
+                await store.aclose()
+        
+        def test():
+            asyncio.run(async_test())
+        
+        self._run_test("Memory: Store async de conversas", test)
+    
+    def _test_redis_backend(self):
+        """Testa o backend Redis contra um servidor local (fakeredis), como 2 workers."""
+        async def async_test(url):
+            from state_backend import RedisBackend
+            worker_a, worker_b = RedisBackend(url), RedisBackend(url)
+            try:
+                await worker_a.set_context("user-1", "web", "create_task", {"title": "Teste"})
+                ctx = await worker_b.get_context("user-1", "web")
+                assert ctx == {"intent": "create_task", "data": {"title": "Teste"}}, f"Shared context mismatch: {ctx}"
+                
+                await worker_b.clear_context("user-1", "web")
+                ctx = await worker_a.get_context("user-1", "web")
+                assert ctx["intent"] == "", f"After clear intent should be empty: {ctx}"
+                
+                # Mesmo lock nos dois "workers": nunca dois turnos ao mesmo tempo
+                running = []
+                async def turn(backend):
+                    async with backend.lock("turn:web:user-1"):
+                        running.append(1)
+                        assert len(running) == 1, "Lock let two turns run together"
+                        await asyncio.sleep(0.02)
+                        running.pop()
+                await asyncio.gather(*(turn(b) for b in (worker_a, worker_b) * 3))
+                
+                # Turno mais longo que o lease: a renovação mantém o lock
+                order = []
+                async def slow():
+                    async with worker_a.lock("turn:web:slow", timeout=0.3):
+                        await asyncio.sleep(0.8)
+                        order.append("slow")
+                async def waiter():
+                    await asyncio.sleep(0.1)
+                    async with worker_b.lock("turn:web:slow", timeout=0.3):
+                        order.append("waiter")
+                await asyncio.gather(slow(), waiter())
+                assert order == ["slow", "waiter"], f"Lease expired mid-turn: {order}"
+            finally:
+                await worker_a.aclose()
+                await worker_b.aclose()
+        
+        def test():
+            try:
+                from fakeredis import TcpFakeServer
+            except ImportError:
+                raise SkipTest("fakeredis não instalado")
+            import threading
+            server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                asyncio.run(async_test(f"redis://127.0.0.1:{server.server_address[1]}/0"))
+            finally:
+                server.shutdown()
+                server.server_close()
+        
+        self._run_test("Memory: Backend Redis compartilhado", test)
+    
     # =================================================================
     # TESTES DE API TWENTY
     # =================================================================
@@ -423,6 +558,149 @@ Responda APENAS com JSON: {{"novos": {{...}}}}"""
         
         self._run_test("Edge: Usuários concorrentes", test)
     
+    def _test_dispatcher(self):
+        """Testa fila por usuário: ordem, rajadas juntadas e paralelismo."""
+        async def async_test():
+            from dispatcher import Dispatcher
+            running = {}
+            seen = []
+            
+            async def handler(user_id, channel, message, on_chunk=None):
+                assert not running.get(user_id), f"Concurrent turns for {user_id}"
+                running[user_id] = True
+                seen.append((user_id, message))
+                await asyncio.sleep(0.05)
+                running[user_id] = False
+                return f"ok:{message}"
+            
+            dispatcher = Dispatcher(handler, max_concurrency=4)
+            first = await dispatcher.submit("burst", "test", "primeira")
+            burst = await asyncio.gather(*(
+                dispatcher.submit("burst", "test", f"msg {i}") for i in range(3)
+            ))
+            assert first == "ok:primeira", f"Unexpected reply: {first}"
+            assert burst[:2] == [None, None], f"Burst should coalesce: {burst}"
+            assert burst[2] == "ok:msg 0\nmsg 1\nmsg 2", f"Unexpected reply: {burst[2]}"
+            
+            start = time.time()
+            await asyncio.gather(*(dispatcher.submit(f"user-{i}", "test", "oi") for i in range(8)))
+            elapsed = time.time() - start
+            assert elapsed < 0.3, f"Users should run in parallel: {elapsed:.2f}s"
+            assert dispatcher.peak_active <= 4, f"Cap exceeded: {dispatcher.peak_active}"
+        
+        def test():
+            asyncio.run(async_test())
+        
+        self._run_test("Dispatcher: Ordem e rajadas", test)
+    
+    def _test_traffic_replay(self):
+        """Grava uma conversa contra os dublês e reproduz sem eles: mesmas respostas."""
+        async def async_test(path):
+            import agent_v2
+            from bench_fakes import fake_twenty_app, serve_in_thread, stop_server, use_fakes
+            from agent_v2 import MondayAgent
+            from http_pool import http_pool
+            from replay import Cassette, install_traffic
+            
+            messages = ["listar pessoas", "criar tarefa", "Ligar para o cliente amanhã às 10h", "oi, tudo bem?"]
+            saved = (agent_v2.TWENTY_URL, agent_v2.TWENTY_KEY)
+            server, url = serve_in_thread(fake_twenty_app())
+            try:
+                recorder = use_fakes(MondayAgent(), url, llm_latency=0.01)
+                cassette = install_traffic(recorder, Cassette(path, "record"))
+                recorded = [await recorder.handle("replay-user", "test", m) for m in messages]
+                cassette.close()
+                await recorder.tools.aclose()
+                await http_pool.aclose()
+            finally:
+                stop_server(server)
+            
+            try:
+                # Twenty desligado e sem Gemini: tudo vem do arquivo
+                player = MondayAgent()
+                cassette = install_traffic(player, Cassette(path, "replay", strict=True))
+                replayed = [await player.handle("replay-user", "test", m) for m in messages]
+                assert replayed == recorded, f"Replay diverged: {replayed} != {recorded}"
+                assert cassette.served > 0, "Nothing served from the recording"
+                await player.tools.aclose()
+            finally:
+                http_pool.wrap_transport(None)
+                await http_pool.aclose()
+                agent_v2.TWENTY_URL, agent_v2.TWENTY_KEY = saved
+        
+        def test():
+            import tempfile
+            with tempfile.TemporaryDirectory() as tmp:
+                asyncio.run(async_test(f"{tmp}/traffic.jsonl"))
+        
+        self._run_test("Replay: Gravação e reprodução do tráfego", test)
+    
+    # =================================================================
+    # TESTES DE PARSERS LOCAIS
+    # =================================================================
+    def _test_date_parser(self):
+        """Testa o parser de datas pt-BR (sábado, 17/10/2026 15:20 em SP)."""
+        def test():
+            import pytz
+            from datetime import datetime
+            now = pytz.timezone("America/Sao_Paulo").localize(datetime(2026, 10, 17, 15, 20))
+            
+            test_cases = [
+                ("amanhã às 10h", "2026-10-18 10:00"),
+                ("sexta que vem", "2026-10-23 09:00"),
+                ("daqui 2 horas", "2026-10-17 17:20"),
+                ("dia 15", "2026-11-15 09:00"),
+                ("20/12 às 14:30", "2026-12-20 14:30"),
+                ("às 3 da tarde", "2026-10-18 15:00"),
+                ("segunda da semana que vem de manhã", "2026-10-19 09:00"),
+            ]
+            
+            for phrase, expected in test_cases:
+                parsed = parse_datetime_pt(phrase, now)
+                assert parsed, f"Phrase '{phrase}' not parsed"
+                got = parsed[0].strftime("%Y-%m-%d %H:%M")
+                assert got == expected, f"Phrase '{phrase}': expected {expected}, got {got}"
+            
+            assert parse_datetime_pt("comprar pão", now) is None, "Should not parse plain text"
+            
+            # Texto comum que não é data, e datas impossíveis
+            for phrase in ("segunda via do boleto", "quinta revisão", "terça parte", "revisar 2 horas de vídeo", "no dia 30/02"):
+                assert parse_datetime_pt(phrase, now) is None, f"Phrase '{phrase}' should not parse"
+            
+            # "2 horas" é duração (fica a data) e "hoje" sem hora não cai no passado
+            for phrase, expected in (("revisar 2 horas de vídeo amanhã", "2026-10-18 09:00"), ("ligar hoje", "2026-10-17 16:00")):
+                got = parse_datetime_pt(phrase, now)[0].strftime("%Y-%m-%d %H:%M")
+                assert got == expected, f"Phrase '{phrase}': expected {expected}, got {got}"
+        
+        self._run_test("Parser: Datas pt-BR", test)
+    
+    def _test_local_create(self):
+        """Testa a criação local (sem LLM): dados separados do nome, ou LLM na dúvida."""
+        def test():
+            import agent_v2
+            from agent_v2 import extract_phone
+            
+            # O atalho não usa estado do agente: dispensa o Gemini e o banco
+            agent = agent_v2.MondayAgent.__new__(agent_v2.MondayAgent)
+            test_cases = [
+                ("criar oportunidade Projeto X de R$ 5 mil", ("create_opportunity", {"amount": 5000.0, "name": "Projeto X"})),
+                ("criar oportunidade Site novo no valor de 10k", ("create_opportunity", {"amount": 10000.0, "name": "Site novo"})),
+                ("criar oportunidade Acme, etapa negociação", ("create_opportunity", {"stage": "NEGOCIACAO", "name": "Acme"})),
+                ("criar oportunidade Ganho de mercado", ("create_opportunity", {"name": "Ganho de mercado"})),
+                ("criar contato João Silva 11 98765-4321", ("create_person", {"phone": "11987654321", "name": "João Silva"})),
+                # Sobrou dado que o extrator não entendeu: vai para o LLM
+                ("criar contato João 11 3333-4444 R$ 200", None),
+                ("criar oportunidade Projeto X R$ 5 mil na etapa proposta", None),
+            ]
+            for message, expected in test_cases:
+                got = agent._local_create(message)
+                assert got == expected, f"'{message}': expected {expected}, got {got}"
+            
+            assert extract_phone("CNPJ 12345678000199") is None, "CNPJ digits read as a phone"
+            assert extract_phone("fone (11) 98765-4321")[0] == "11987654321", "Phone not parsed"
+        
+        self._run_test("Parser: Criação local", test)
+    
     # =================================================================
     # RELATÓRIO
     # =================================================================
@@ -432,13 +710,16 @@ Responda APENAS com JSON: {{"novos": {{...}}}}"""
         print("RELATORIO DE TESTES")
         print("=" * 60)
         
-        passed = sum(1 for r in self.results if r.passed)
+        passed = sum(1 for r in self.results if r.passed and not r.skipped)
         failed = sum(1 for r in self.results if not r.passed)
+        skipped = sum(1 for r in self.results if r.skipped)
         total_time = sum(r.duration for r in self.results)
         
         print(f"\nTotal de testes: {len(self.results)}")
         print(f"  [OK] Passaram: {passed}")
         print(f"  [FAIL] Falharam: {failed}")
+        if skipped:
+            print(f"  [SKIP] Pulados: {skipped}")
         print(f"\nTempo total: {total_time:.2f}s")
         print(f"Tempo medio: {total_time/len(self.results):.2f}s")
         
@@ -449,7 +730,7 @@ Responda APENAS com JSON: {{"novos": {{...}}}}"""
                     print(f"  • {r.name}")
                     print(f"    Erro: {r.error}")
         
-        success_rate = (passed / len(self.results)) * 100
+        success_rate = (passed / max(1, passed + failed)) * 100
         print(f"\nTaxa de sucesso: {success_rate:.1f}%")
         
         if success_rate >= 90:
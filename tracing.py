@@ -0,0 +1,197 @@
+"""
+Monday CRM Agent - Tracing por requisição
+Trace ID por mensagem, spans por etapa e uma linha JSON por turno com o detalhamento
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+TRACE_LOG = os.getenv("TRACE_LOG", "1").lower() not in ("0", "false", "no")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))  # só loga turnos acima disso
+# Com o endpoint definido (ex: http://localhost:4318), os spans também vão via OTLP
+OTEL_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+
+logger = logging.getLogger("monday.trace")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current: ContextVar = ContextVar("monday_span", default=None)
+_tracer = None
+
+
+class Span:
+    """Uma etapa do turno (handle, llm, tool, twenty, context...)."""
+
+    __slots__ = ("name", "attrs", "trace", "span_id", "parent_id", "start", "end", "status")
+
+    def __init__(self, name: str, attrs: dict, trace: "Trace", parent: Optional["Span"]):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.perf_counter()
+        self.end = None
+        self.status = "ok"
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        return round(((self.end or time.perf_counter()) - self.start) * 1000, 2)
+
+    @property
+    def traceparent(self) -> str:
+        """Header W3C para propagar o trace em chamadas HTTP."""
+        return f"00-{self.trace.trace_id}-{self.span_id}-01"
+
+
+class Trace:
+    """Todos os spans de uma mensagem, sob o mesmo trace_id."""
+
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+
+    def to_dict(self) -> dict:
+        root = self.spans[0]
+        breakdown = {}
+        for s in self.spans[1:]:
+            breakdown[s.name] = round(breakdown.get(s.name, 0) + s.duration_ms, 2)
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "duration_ms": root.duration_ms,
+            "status": root.status,
+            **root.attrs,
+            "breakdown": breakdown,
+            "spans": [
+                {
+                    "name": s.name,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "start_ms": round((s.start - root.start) * 1000, 2),
+                    "duration_ms": s.duration_ms,
+                    "status": s.status,
+                    **s.attrs,
+                }
+                for s in self.spans[1:]
+            ],
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace.trace_id if span else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Abre um span filho do atual; sem span atual, começa um trace novo.
+
+    Funciona em volta de `await` (o contexto segue a task). Ao fechar o span
+    raiz, o trace inteiro vira uma linha JSON no logger monday.trace.
+    """
+    parent = _current.get()
+    trace = parent.trace if parent else Trace()
+    current = Span(name, attrs, trace, parent)
+    trace.spans.append(current)
+    token = _current.set(current)
+    otel = _otel_span(name, attrs)
+    if otel is not None:
+        # Mesmos IDs do OpenTelemetry: o log JSON e o coletor batem
+        context = otel[1].get_span_context()
+        current.span_id = f"{context.span_id:016x}"
+        if parent is None:
+            trace.trace_id = f"{context.trace_id:032x}"
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.attrs["error"] = f"{type(e).__name__}: {str(e)[:200]}"
+        raise
+    finally:
+        current.end = time.perf_counter()
+        if otel is not None:
+            _otel_end(otel, current)
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(parent)  # Fechado em outro contexto (ex: async generator)
+        if parent is None:
+            _emit(trace)
+
+
+def traced(name: str):
+    """Decorator: roda a coroutine dentro de um span `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _emit(trace: Trace):
+    if not TRACE_LOG or trace.spans[0].duration_ms < TRACE_SLOW_MS:
+        return
+    logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+
+
+# ---------- OPENTELEMETRY (opcional) ----------
+def _otel_tracer():
+    global _tracer, OTEL_ENDPOINT
+    if _tracer is None and OTEL_ENDPOINT:
+        try:
+            from opentelemetry import trace as otel_trace
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("[Warning] OTEL_EXPORTER_OTLP_ENDPOINT definido, mas opentelemetry-sdk/exporter não instalados")
+            OTEL_ENDPOINT = ""
+            return None
+        provider = TracerProvider(resource=Resource.create({"service.name": "monday-crm-agent"}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        otel_trace.set_tracer_provider(provider)
+        _tracer = otel_trace.get_tracer("monday")
+    return _tracer
+
+
+def _otel_span(name: str, attrs: dict):
+    tracer = _otel_tracer()
+    if tracer is None:
+        return None
+    cm = tracer.start_as_current_span(name, attributes={k: str(v) for k, v in attrs.items()})
+    otel = cm.__enter__()
+    return cm, otel
+
+
+def _otel_end(otel, current: Span):
+    cm, otel_span = otel
+    for key, value in current.attrs.items():
+        otel_span.set_attribute(key, str(value))
+    if current.status == "error":
+        from opentelemetry.trace import Status, StatusCode
+        otel_span.set_status(Status(StatusCode.ERROR, current.attrs.get("error")))
+    cm.__exit__(None, None, None)